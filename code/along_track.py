@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Sampling of reanalysis fields along tracks.
+
+Track points are grouped by time, so that each time slice of a reanalysis
+variable is read once, and all points of that time step are then interpolated
+in one vectorised operation. Fields can be sampled at the nearest grid point,
+interpolated bilinearly, or reduced (max, mean, min) over all grid points
+within a radius from the track point.
+
+Example
+-------
+>>> sst = field_reader("era5", "sst")
+>>> t500 = field_reader("era5", "t", levtype="pl", level=500)
+>>> tr = add_columns(
+...     tr,
+...     {
+...         "max_wind10": dict(field=wind_speed_reader("era5"), radius_km=150, reduce="max"),
+...         "sst_t500": dict(field=lambda t: sst(t) - t500(t), method="bilinear"),
+...         "ci_genesis": dict(field=field_reader("era5", "ci"), genesis=True),
+...     },
+... )
+"""
+from functools import lru_cache
+import warnings
+
+from loguru import logger
+
+import numpy as np
+
+from common_defs import EARTH_RADIUS
+import mypaths
+from track_io import replace_data
+
+
+# Approximate length of 1 degree of latitude [km]
+KM_PER_DEG = 111.2
+METHODS = ["nearest", "bilinear"]
+REDUCE_FUNCS = {"max": np.nanmax, "mean": np.nanmean, "min": np.nanmin}
+
+
+def reanalysis_path(dset, varname, year, month, levtype="sfc"):
+    """Path to a monthly file of a reanalysis variable, as saved by download_reanalysis.py."""
+    dset_dir = getattr(mypaths, f"{dset}_dir")
+    return dset_dir / f"{dset}.an.{levtype}.{year}.{month:02d}.{varname}.nc"
+
+
+def field_reader(dset, varname, levtype="sfc", level=None, cache_size=2):
+    """
+    Make a function reading a 2D field of a reanalysis variable at a given time.
+
+    Monthly files are opened lazily and kept open, so reading consecutive time
+    steps only reads one time slice from disk each time.
+
+    Parameters
+    ----------
+    dset: str
+        Name of the reanalysis (era5 or interim)
+    varname: str
+        Short name of the variable, as in file names (e.g. sst, ci, u, t)
+    levtype: str, optional
+        Level type, "sfc" or "pl"
+    level: float, optional
+        Pressure level [hPa], required if levtype="pl"
+    cache_size: int, optional
+        Number of monthly files kept open
+
+    Returns
+    -------
+    callable
+        Function of `numpy.datetime64` returning a 2D `xarray.DataArray`
+        with latitude and longitude coordinates
+    """
+    import xarray as xr
+
+    @lru_cache(maxsize=cache_size)
+    def _open(year, month):
+        path = reanalysis_path(dset, varname, year, month, levtype=levtype)
+        logger.debug(f"Opening {path}")
+        ds = xr.open_dataset(path)
+        da = ds[list(ds.data_vars)[0]]
+        if level is not None:
+            da = da.sel(level=level)
+        return da
+
+    def _read(time):
+        ts = time.astype("datetime64[s]").item()
+        return _open(ts.year, ts.month).sel(time=time).load()
+
+    return _read
+
+
+def wind_speed_reader(dset, levtype="sfc", level=None, names=("u10", "v10")):
+    """Make a function reading the wind speed from its u- and v-components."""
+    u_reader = field_reader(dset, names[0], levtype=levtype, level=level)
+    v_reader = field_reader(dset, names[1], levtype=levtype, level=level)
+
+    def _read(time):
+        return (u_reader(time) ** 2 + v_reader(time) ** 2) ** 0.5
+
+    return _read
+
+
+def great_circle_km(lon1, lat1, lon2, lat2):
+    """Great circle distance [km] between points given in degrees."""
+    lon1, lat1, lon2, lat2 = [np.deg2rad(i) for i in (lon1, lat1, lon2, lat2)]
+    hav = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(hav, 0, 1)))
+
+
+def _grid(field):
+    """Regular grid coordinates of a 2D field."""
+    lon = field["longitude"].values.astype(float)
+    lat = field["latitude"].values.astype(float)
+    return lon, lat
+
+
+def _frac_index(coord, x):
+    """Fractional index of `x` in a regularly spaced coordinate array."""
+    return (x - coord[0]) / (coord[1] - coord[0])
+
+
+def _wrap_lon(lon_grid, lon):
+    """Shift longitudes to the range of the grid, e.g. -20 to 340 for a 0-360 grid."""
+    return (lon - lon_grid[0]) % 360 + lon_grid[0]
+
+
+def interp_points(field, lon, lat, method="nearest"):
+    """
+    Interpolate a 2D field to points.
+
+    Parameters
+    ----------
+    field: xarray.DataArray
+        Field on a regular (latitude, longitude) grid
+    lon, lat: numpy.ndarray
+        Coordinates of points
+    method: str, optional
+        Interpolation method, "nearest" or "bilinear"
+
+    Returns
+    -------
+    numpy.ndarray
+        Values at the points, NaN outside the grid
+    """
+    lon_grid, lat_grid = _grid(field)
+    arr = field.transpose("latitude", "longitude").values
+    ny, nx = arr.shape
+    fx = _frac_index(lon_grid, _wrap_lon(lon_grid, lon))
+    fy = _frac_index(lat_grid, lat)
+    out = np.full(lon.shape, np.nan)
+    if method == "nearest":
+        ix, iy = np.rint(fx).astype(int), np.rint(fy).astype(int)
+        ok = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        out[ok] = arr[iy[ok], ix[ok]]
+    elif method == "bilinear":
+        ok = (fx >= 0) & (fx <= nx - 1) & (fy >= 0) & (fy <= ny - 1)
+        ix0 = np.clip(np.floor(fx[ok]).astype(int), 0, nx - 2)
+        iy0 = np.clip(np.floor(fy[ok]).astype(int), 0, ny - 2)
+        wx, wy = fx[ok] - ix0, fy[ok] - iy0
+        out[ok] = (
+            arr[iy0, ix0] * (1 - wx) * (1 - wy)
+            + arr[iy0, ix0 + 1] * wx * (1 - wy)
+            + arr[iy0 + 1, ix0] * (1 - wx) * wy
+            + arr[iy0 + 1, ix0 + 1] * wx * wy
+        )
+    else:
+        raise ValueError(f"method should be one of {METHODS}")
+    return out
+
+
+def reduce_points(field, lon, lat, radius_km, reduce="max"):
+    """
+    Reduce a 2D field over grid points within `radius_km` from each point.
+
+    A rectangular stencil of grid points large enough to contain the circle
+    around the most poleward point is applied to all points at once, then grid
+    points farther than `radius_km` are masked out.
+
+    Parameters
+    ----------
+    field: xarray.DataArray
+        Field on a regular (latitude, longitude) grid
+    lon, lat: numpy.ndarray
+        Coordinates of points
+    radius_km: float
+        Radius of the neighbourhood [km]
+    reduce: str, optional
+        Reduction, one of "max", "mean", "min"
+
+    Returns
+    -------
+    numpy.ndarray
+        Reduced values, NaN if no grid points are within the radius
+    """
+    lon_grid, lat_grid = _grid(field)
+    arr = field.transpose("latitude", "longitude").values
+    ny, nx = arr.shape
+    dlon, dlat = abs(lon_grid[1] - lon_grid[0]), abs(lat_grid[1] - lat_grid[0])
+    max_coslat = max(np.cos(np.deg2rad(np.abs(lat).max())), 1e-3) if lat.shape[0] else 1
+    n_y = int(np.ceil(radius_km / (KM_PER_DEG * dlat)))
+    n_x = min(int(np.ceil(radius_km / (KM_PER_DEG * dlon * max_coslat))), nx // 2)
+    dj, di = [i.ravel() for i in np.meshgrid(np.arange(-n_x, n_x + 1), np.arange(-n_y, n_y + 1))]
+
+    ix = np.rint(_frac_index(lon_grid, _wrap_lon(lon_grid, lon))).astype(int)[:, np.newaxis] + dj
+    iy = np.rint(_frac_index(lat_grid, lat)).astype(int)[:, np.newaxis] + di
+    inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    ix, iy = np.clip(ix, 0, nx - 1), np.clip(iy, 0, ny - 1)
+    dist = great_circle_km(lon[:, np.newaxis], lat[:, np.newaxis], lon_grid[ix], lat_grid[iy])
+    vals = np.where(inside & (dist <= radius_km), arr[iy, ix], np.nan)
+    with warnings.catch_warnings():
+        # Points with no grid points nearby yield NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return REDUCE_FUNCS[reduce](vals, axis=1)
+
+
+def sample_rows(data, field, method="nearest", radius_km=None, reduce="max", pbar=iter):
+    """
+    Sample a reanalysis field at every row of a track table.
+
+    Parameters
+    ----------
+    data: pandas.DataFrame
+        Track table with lon, lat and time columns
+    field: callable
+        Function returning a 2D `xarray.DataArray` for a given time, e.g. from `field_reader()`
+    method: str, optional
+        Interpolation method, "nearest" or "bilinear". Ignored if `radius_km` is given.
+    radius_km: float, optional
+        If given, reduce the field over the neighbourhood of each point instead of interpolating
+    reduce: str, optional
+        Reduction over the neighbourhood, one of "max", "mean", "min"
+    pbar: callable, optional
+        Progress bar wrapper of the loop over time steps
+
+    Returns
+    -------
+    numpy.ndarray
+        Values of the field, in the order of rows of `data`
+    """
+    times = data["time"].values.astype("datetime64[ns]")
+    lon, lat = data["lon"].values.astype(float), data["lat"].values.astype(float)
+    out = np.full(times.shape, np.nan)
+    if times.shape[0] == 0:
+        return out
+    uniq, inv = np.unique(times, return_inverse=True)
+    order = np.argsort(inv, kind="mergesort")
+    groups = np.split(order, np.cumsum(np.bincount(inv, minlength=uniq.shape[0]))[:-1])
+    for time, rows in pbar(list(zip(uniq, groups))):
+        try:
+            fld = field(time)
+        except (KeyError, FileNotFoundError) as e:
+            logger.warning(f"No data at {time}: {e}")
+            continue
+        if radius_km is None:
+            out[rows] = interp_points(fld, lon[rows], lat[rows], method=method)
+        else:
+            out[rows] = reduce_points(fld, lon[rows], lat[rows], radius_km, reduce=reduce)
+    return out
+
+
+def add_columns(tr, fields, pbar=iter):
+    """
+    Sample reanalysis fields along tracks of a `TrackRun` and append them as new columns.
+
+    Parameters
+    ----------
+    tr: octant.core.TrackRun
+        Track run
+    fields: dict
+        Dictionary of new column names and keyword arguments of `sample_rows()`.
+        An additional keyword `genesis=True` samples the field only at the first
+        point of each track; the value is then repeated along the whole track.
+    pbar: callable, optional
+        Progress bar wrapper of the loop over time steps
+
+    Returns
+    -------
+    octant.core.TrackRun
+        Shallow copy of `tr` with the new columns
+    """
+    data = tr.data.copy()
+    level = data.index.get_level_values(0).values
+    # Boolean even for an empty table, where fields are added as empty columns
+    first = np.ones(level.shape, dtype=bool)
+    first[1:] = level[1:] != level[:-1]
+    for name, kwargs in fields.items():
+        kwargs = dict(kwargs)
+        if kwargs.pop("genesis", False):
+            vals = sample_rows(data[first], pbar=pbar, **kwargs)
+            data[name] = np.repeat(vals, np.diff(np.append(np.flatnonzero(first), len(data))))
+        else:
+            data[name] = sample_rows(data, pbar=pbar, **kwargs)
+        logger.info(f"Sampled {name}")
+    return replace_data(tr, data)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Cached loading of processed `TrackRun` archives.
+
+Selections from archives are kept in a small LRU cache keyed on the file path,
+modification time and selection arguments; its size can be set with the
+`ARCHIVE_CACHE_SIZE` environment variable. Optionally, a copy of each archive is saved in a columnar
+format (Parquet) in `FAST_DIR`, which allows reading only selected columns
+and makes reloading in a new session much faster than reading HDF5.
+
+Columns and tracks within a time range (found using the time index of the archive)
+are selected when reading the Parquet copy, or archives with the track table
+in the HDF5 table format. Archives in the fixed format can only be read whole.
+"""
+import copy
+from functools import lru_cache
+import os
+from pathlib import Path
+import pickle
+import threading
+
+from loguru import logger
+
+import numpy as np
+
+import pandas as pd
+
+from common_defs import period as PERIOD
+from compact import compact_frame
+import mypaths
+from time_index import load_time_index
+from track_io import MUX_NAMES, atomic_path, replace_data
+
+
+FAST_DIR = mypaths.procdir / "fast"
+LRU_SIZE = int(os.getenv("ARCHIVE_CACHE_SIZE", 4))
+# HDF5 files are read by one thread at a time, because PyTables is not thread-safe
+HDF_LOCK = threading.RLock()
+
+
+def archive_path(dset, run_id, period=PERIOD, suffix=""):
+    """Path to a processed `TrackRun` archive."""
+    return mypaths.procdir / f"{dset}_run{run_id:03d}_{period}{suffix}.h5"
+
+
+def _fast_paths(path):
+    return FAST_DIR / f"{path.stem}.parquet", FAST_DIR / f"{path.stem}.meta.pkl"
+
+
+def _metadata(tr):
+    """Attributes of a `TrackRun` except the track table and other pandas objects."""
+    return {
+        k: v
+        for k, v in vars(tr).items()
+        if k != "data" and not type(v).__module__.startswith("pandas")
+    }
+
+
+def write_fast(path, tr, mtime_ns):
+    """
+    Save a `TrackRun` loaded from `path` in the fast format.
+
+    Both files are written to uniquely named temporary files and renamed, the Parquet
+    file last, so that concurrent writers in other threads or processes do not
+    clobber each other's files. The Parquet file also stores the modification time
+    of the archive, so that a reader never combines it with metadata of another
+    version of the archive.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    pq_path, meta_path = _fast_paths(path)
+    FAST_DIR.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(pd.DataFrame(tr.data).reset_index(), preserve_index=False)
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), b"source_mtime_ns": str(mtime_ns).encode()}
+    )
+    with atomic_path(meta_path) as tmp, tmp.open("wb") as fout:
+        pickle.dump(dict(source_mtime_ns=mtime_ns, attrs=_metadata(tr)), fout)
+    with atomic_path(pq_path) as tmp:
+        pq.write_table(table, str(tmp))
+
+
+def read_fast(path, mtime_ns, columns=None, track_ids=None):
+    """
+    Read a `TrackRun` from the fast format, optionally only `columns` and `track_ids`.
+
+    Returns None if the fast copy does not exist or is older than the archive.
+    """
+    import pyarrow.parquet as pq
+    from octant.core import OctantTrack, TrackRun
+
+    pq_path, meta_path = _fast_paths(path)
+    try:
+        with meta_path.open("rb") as fin:
+            meta = pickle.load(fin)
+        if meta["source_mtime_ns"] != mtime_ns:
+            return None
+        if columns is not None:
+            columns = MUX_NAMES + [i for i in columns if i not in MUX_NAMES]
+        filters = None if track_ids is None else [(MUX_NAMES[0], "in", list(track_ids))]
+        table = pq.read_table(pq_path, columns=columns, filters=filters)
+    except FileNotFoundError:
+        return None
+    if (table.schema.metadata or {}).get(b"source_mtime_ns") != str(mtime_ns).encode():
+        return None
+    df = table.to_pandas()
+    tr = TrackRun()
+    tr.__dict__.update(meta["attrs"])
+    tr.data = OctantTrack.from_mux_df(df.set_index(MUX_NAMES))
+    return tr
+
+
+def _window_tracks(path, time_range):
+    """
+    Tracks of an archive overlapping `time_range`, found using its time index.
+
+    Returns
+    -------
+    track_ids: numpy.ndarray
+        Track indices
+    rows: numpy.ndarray
+        Row positions of the tracks in the track table
+
+    Both are None if the archive has no time index.
+    """
+    with HDF_LOCK:
+        index = load_time_index(path)
+    if index is None:
+        return None, None
+    start, end = [np.datetime64(pd.Timestamp(i), "ns") for i in time_range]
+    index = index[(index["t_start"].values <= end) & (index["t_end"].values >= start)]
+    index = index.sort_values("pos_start")
+    counts = (index["pos_end"] - index["pos_start"]).values
+    rows = np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts - index["pos_start"].values, counts
+    )
+    return index.index.values, rows
+
+
+def read_hdf_table(path, columns=None, rows=None):
+    """
+    Read selected columns and rows of the track table of an archive in the HDF5 table format.
+
+    The tracking settings are not restored. Returns None if the archive is in the fixed format.
+    """
+    from octant.core import OctantTrack, TrackRun
+    from octant.params import ARCH_KEY
+
+    with HDF_LOCK, pd.HDFStore(path, mode="r") as store:
+        storer = store.get_storer(ARCH_KEY)
+        if not storer.is_table:
+            return None
+        if columns is not None:
+            columns = MUX_NAMES + [i for i in columns if i not in MUX_NAMES]
+        df = store.select(ARCH_KEY, where=rows, columns=columns)
+        metadata = dict(storer.attrs.metadata)
+    tr = TrackRun()
+    tr.__dict__.update({k: v for k, v in metadata.items() if k != "conf"})
+    tr.data = OctantTrack.from_mux_df(df.set_index(MUX_NAMES))
+    return tr
+
+
+def _load(path, mtime_ns, columns, fast, time_range):
+    from octant.core import TrackRun
+
+    track_ids, rows = None, None
+    if time_range is not None:
+        track_ids, rows = _window_tracks(path, time_range)
+    tr = None
+    if fast:
+        tr = read_fast(path, mtime_ns, columns=columns, track_ids=track_ids)
+    elif rows is not None or columns is not None:
+        tr = read_hdf_table(path, columns=columns, rows=rows)
+    if tr is None:
+        logger.debug(f"Reading {path}")
+        with HDF_LOCK:
+            tr = TrackRun.from_archive(path)
+        if fast:
+            write_fast(path, tr, mtime_ns)
+        if columns is not None:
+            tr = replace_data(tr, tr.data[list(columns)])
+    return tr
+
+
+@lru_cache(maxsize=LRU_SIZE)
+def _select(path, mtime_ns, columns, fast, subset, time_range, compact):
+    tr = _load(path, mtime_ns, columns, fast, time_range)
+    data = tr.data
+    if time_range is not None:
+        # Select whole tracks that have at least one point within the time range,
+        # in case the archive was read whole
+        start, end = [np.datetime64(pd.Timestamp(i)) for i in time_range]
+        bounds = data["time"].groupby(level=MUX_NAMES[0]).agg(["min", "max"])
+        sel = bounds.index[(bounds["min"] <= end) & (bounds["max"] >= start)]
+        data = data[data.index.get_level_values(0).isin(sel)]
+    if subset is not None:
+        data = replace_data(tr, data)[subset]
+    if compact:
+        data = compact_frame(data)
+    if data is tr.data:
+        return tr
+    return replace_data(tr, data)
+
+
+def load_trackrun(path, subset=None, columns=None, time_range=None, fast=True, compact=False):
+    """
+    Load a `TrackRun` archive, or a part of it, using the in-process and on-disk caches.
+
+    Parameters
+    ----------
+    path: path-like
+        Path to the .h5 archive
+    subset: str, optional
+        Category of tracks to select, e.g. "pmc"
+    columns: list, optional
+        Columns to load. The category column is needed to select a `subset`.
+    time_range: tuple, optional
+        Start and end of the time period. Tracks with at least one point within it
+        are selected.
+    fast: bool, optional
+        Use the fast on-disk format, creating it if necessary
+    compact: bool, optional
+        Convert the track table to compact data types (see `compact.compact_frame`)
+
+    Returns
+    -------
+    octant.core.TrackRun
+        A shallow copy of the cached object. The track table is shared between
+        calls with the same arguments, so it is read-only and should not be
+        modified in place.
+
+    Examples
+    --------
+    >>> tr = load_trackrun(archive_path("era5", 0), subset="pmc",
+    ...                    time_range=("2008-10-01", "2009-04-30"))
+    """
+    path = Path(path).absolute()
+    mtime_ns = path.stat().st_mtime_ns
+    if columns is not None:
+        columns = tuple(columns)
+        if subset is not None and "cat" not in columns:
+            columns += ("cat",)
+        if time_range is not None and "time" not in columns:
+            columns += ("time",)
+    if time_range is not None:
+        time_range = tuple(str(pd.Timestamp(i)) for i in time_range)
+    return copy.copy(_select(path, mtime_ns, columns, fast, subset, time_range, compact))
+
+
+def clear_cache():
+    """Empty the in-process cache."""
+    _select.cache_clear()
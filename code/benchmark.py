@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""Benchmark categorisation, matching and density code on synthetic data."""
+import argparse
+from datetime import datetime
+import json
+from pathlib import Path
+import resource
+import subprocess
+import sys
+import tempfile
+from textwrap import dedent
+import time
+import tracemalloc
+
+from loguru import logger as L
+
+import numpy as np
+
+from common_defs import bbox, winter_dates, winters
+import synthetic
+
+SCRIPT = Path(__file__).name
+LOGPATH = Path(__file__).parent / "logs"
+CASES = ["import", "ingest", "categorise", "prepare_tracks", "match", "compact", "density"]
+# Modules that need heavy dependencies at import by design: plotting, downloads and this one
+IMPORT_EXCLUDE = ["benchmark", "download_reanalysis", "download_seaice", "map_cache", "plot_utils"]
+# All other modules of the package and heavy dependencies that they should not import
+IMPORT_MODULES = sorted(
+    path.stem for path in Path(__file__).parent.glob("*.py") if path.stem not in IMPORT_EXCLUDE
+)
+HEAVY_MODULES = ["octant", "xarray", "scipy", "cartopy", "rasterio"]
+
+
+def parse_args(args=None):
+    """Parse command line arguments."""
+    epilog = dedent(
+        f"""Example of use:
+    ./{SCRIPT} -t 500 -w 2 --cases categorise,match
+    ./{SCRIPT} --cases import
+    ./{SCRIPT} --show
+    """
+    )
+    ap = argparse.ArgumentParser(
+        SCRIPT,
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog=epilog,
+    )
+    ap.add_argument("-t", "--tracks", type=int, default=200, help="Number of tracks per winter")
+    ap.add_argument("-w", "--winters", type=int, default=2, help="Number of winters")
+    ap.add_argument("--tstep", type=int, default=1, help="Time step of tracks (h)")
+    ap.add_argument("--stars", type=int, default=50, help="Number of reference tracks")
+    ap.add_argument("--res", type=float, default=0.25, help="Land mask grid resolution (deg)")
+    ap.add_argument("--seed", type=int, default=0, help="Random seed")
+    ap.add_argument(
+        "--cases", type=str, default=",".join(CASES), help="Comma-separated list of benchmarks"
+    )
+    ap.add_argument(
+        "--workdir", type=str, default=None, help="Directory for synthetic data (default: tmp)"
+    )
+    ap.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=str(LOGPATH / "benchmarks.jsonl"),
+        help="File to append results to",
+    )
+    ap.add_argument("--show", action="store_true", help="Print saved results and exit")
+    return ap.parse_args(args)
+
+
+def git_commit():
+    """Get the hash of the current commit, if available."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            universal_newlines=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def measure(func, *args, **kwargs):
+    """
+    Call a function twice, measuring the wall time of the first call and peak memory of the second.
+
+    The first call is timed with memory tracing off, since `tracemalloc` slows down
+    Python code by a large factor. `func` should therefore give the same result
+    when called again with the same arguments.
+
+    Returns
+    -------
+    result: object
+        Whatever `func` returns in the timed call
+    stats: dict
+        Wall time [s], peak traced memory [MB] and maximum resident set size [MB]
+    """
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result, dict(seconds=elapsed, peak_mb=peak / 1024 ** 2, maxrss_mb=maxrss)
+
+
+def import_time(module):
+    """
+    Import a module in a new interpreter.
+
+    Returns
+    -------
+    dict
+        Import time [s] and the list of `HEAVY_MODULES` that were imported
+    """
+    code = dedent(
+        f"""
+        import json, sys, time
+        t0 = time.perf_counter()
+        import {module}
+        elapsed = time.perf_counter() - t0
+        heavy = [i for i in {HEAVY_MODULES!r} if i in sys.modules]
+        print(json.dumps(dict(seconds=elapsed, heavy=heavy)))
+        """
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=Path(__file__).parent,
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    ).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def import_benchmarks(modules=IMPORT_MODULES):
+    """Measure import times of modules and check that they do not import heavy dependencies."""
+    records = []
+    for module in modules:
+        stats = import_time(module)
+        if stats["heavy"]:
+            L.warning(f"{module} imports {', '.join(stats['heavy'])}")
+        L.info(f"import {module}: {stats['seconds']:.3f}s")
+        records.append(dict(case=f"import[{module}]", n=1, unit="modules", **stats))
+    return records
+
+
+def make_inputs(workdir, args):
+    """Generate synthetic tracks, land mask and STARS-like file in `workdir`."""
+    workdir = Path(workdir)
+    run_dir = synthetic.make_run_dir(
+        workdir / "tracks", winters[: args.winters], args.tracks, tstep_h=args.tstep, seed=args.seed
+    )
+    lsm_path = synthetic.write_lsm(workdir / "lsm.nc", res=args.res, seed=args.seed)
+    stars_path = synthetic.make_stars_file(
+        workdir / "stars.txt", args.stars, winters[: args.winters], seed=args.seed
+    )
+    return run_dir, lsm_path, stars_path
+
+
+def run_benchmarks(workdir, args):
+    """Run selected benchmarks and return a list of records."""
+    from categorise_and_save import categorise_winter, make_conditions, make_masks
+    from match_to_ref import REF_DATASETS, match_options, match_run
+    from obs_tracks_api import prepare_tracks, read_stars_file
+    from octant.core import TrackRun
+
+    cases = args.cases.split(",")
+    run_dir, lsm_path, stars_path = make_inputs(workdir, args)
+    sel_winters = winters[: args.winters]
+
+    records = []
+
+    def _record(case, stats, n_items, unit, **extra):
+        rec = dict(case=case, n=n_items, unit=unit, **stats, **extra)
+        rec["throughput"] = n_items / stats["seconds"] if stats["seconds"] > 0 else np.nan
+        L.info(f"{case}: {stats['seconds']:.3f}s, {rec['throughput']:.1f} {unit}/s")
+        records.append(rec)
+
+    if "ingest" in cases:
+        from track_io import ingest_dir
+
+        for use_cache, label in [(False, "ingest[text]"), (True, "ingest[cache]")]:
+            t_stats = dict(seconds=0.0, peak_mb=0.0, maxrss_mb=0.0)
+            for winter in sel_winters:
+                _, stats = measure(ingest_dir, run_dir / winter, use_cache=use_cache)
+                t_stats["seconds"] += stats["seconds"]
+                t_stats["peak_mb"] = max(t_stats["peak_mb"], stats["peak_mb"])
+                t_stats["maxrss_mb"] = stats["maxrss_mb"]
+            _record(label, t_stats, args.tracks * len(sel_winters), "tracks")
+
+    # Categorisation is needed by the matching and density benchmarks
+    mask, gen_mask = make_masks(lsm_path, bbox)
+    conditions = make_conditions(mask, gen_mask)
+
+    def _categorise():
+        full_tr = TrackRun()
+        for winter in sel_winters:
+            full_tr += categorise_winter(run_dir / winter, conditions)
+        return full_tr
+
+    full_tr, stats = measure(_categorise)
+    if "categorise" in cases:
+        _record("categorise", stats, len(full_tr), "tracks")
+
+    if "prepare_tracks" in cases or "match" in cases:
+        obs_df = read_stars_file(stars_path)
+        obs_tracks, stats = measure(
+            prepare_tracks, obs_df, filter_funcs=REF_DATASETS["stars"]["filter_func"]
+        )
+        if "prepare_tracks" in cases:
+            _record("prepare_tracks", stats, obs_df.N.nunique(), "tracks")
+
+    if "match" in cases:
+        time_dict = {k: winter_dates[k] for k in sel_winters}
+        for match_kwargs in match_options:
+            _, stats = measure(match_run, full_tr, obs_tracks, match_kwargs, time_dict)
+            label = "_".join(f"{k}={v}" for k, v in match_kwargs.items())
+            _record(f"match[{label}]", stats, full_tr.size("pmc"), "tracks")
+
+    if "compact" in cases:
+        from compact import check_compact
+
+        # Categorisation and matching of the compact track table should give the same results
+        check, stats = measure(
+            check_compact,
+            full_tr,
+            conditions=conditions,
+            obs_tracks=obs_tracks if "match" in cases else None,
+            match_kwargs=match_options[0],
+            time_dict={k: winter_dates[k] for k in sel_winters},
+        )
+        _record("compact", stats, len(full_tr), "tracks", **check)
+
+    if "density" in cases:
+        from octant.misc import calc_all_dens
+
+        lon1d = np.arange(bbox[0] + 1, bbox[1] - 1 + 0.1, 0.5)
+        lat1d = np.arange(bbox[2] + 1, bbox[3] - 1 + 0.1, 0.5)
+        _, stats = measure(calc_all_dens, full_tr, lon1d, lat1d, method="cell")
+        _record("density", stats, full_tr.data.shape[0], "points")
+
+    return records
+
+
+def show(path):
+    """Print saved benchmark results as a table of timings across commits."""
+    import pandas as pd
+
+    df = pd.read_json(path, lines=True)
+    with pd.option_context("display.width", 200, "display.max_rows", None):
+        print(
+            df.pivot_table(
+                index=["case", "tracks", "winters"],
+                columns="commit",
+                values=["seconds", "peak_mb"],
+                aggfunc="min",
+            )
+        )
+
+
+def main(args=None):
+    """Generate synthetic data, run benchmarks and append results to a file."""
+    args = parse_args(args)
+    output = Path(args.output)
+    if args.show:
+        show(output)
+        return
+
+    meta = dict(
+        commit=git_commit(),
+        date=f"{datetime.now():%Y-%m-%dT%H:%M:%S}",
+        tracks=args.tracks,
+        winters=args.winters,
+        tstep=args.tstep,
+        stars=args.stars,
+    )
+    cases = args.cases.split(",")
+    records = []
+    if "import" in cases:
+        records += import_benchmarks()
+    if set(cases) - {"import"}:
+        if args.workdir is None:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                records += run_benchmarks(tmpdir, args)
+        else:
+            records += run_benchmarks(args.workdir, args)
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open("a") as fout:
+        for rec in records:
+            fout.write(json.dumps({**meta, **rec}) + "\n")
+    # Fail if a heavy dependency is imported at startup again
+    return int(any(rec.get("heavy") for rec in records))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,16 +7,15 @@ from textwrap import dedent
 
 from loguru import logger
 
-import numpy as np
-
-from octant.core import TrackRun
-from octant.decor import get_pbar
-from octant.misc import add_domain_bounds_to_mask, check_by_arr_thresh, check_by_mask
-
-import xarray as xr
-
-from common_defs import bbox, columns, period, winters, SMOOTH_FUNC, SMOOTH_KW
+from common_defs import CAT, bbox, columns, period, regions, region_gen_lat_max, winters
+from common_defs import SMOOTH_FUNC, SMOOTH_KW
+from compact import compact_trackrun
 import mypaths
+from prefetch import prefetch
+from sea_ice import DOMAIN, SEAICE_DATASETS, SeaIceCube, SeaIceGenesis, grid_covers_box
+from shards import SHARD_DIR, add_shard_arg, categorised_path, select_shard
+from time_index import build_time_index, save_time_index
+from track_io import load_tracks
 
 # Select runs
 # runs2process = dict(era5=[0])  # , interim=[100, 106])
@@ -29,6 +28,7 @@ def parse_args(args=None):
     epilog = dedent(
         f"""Example of use:
     ./{SCRIPT} -n era5 --runs 0,3,10,11 -ll 10,20,65,85
+    ./{SCRIPT} -n era5 --runs 0 --regions nordic_seas,barents_sea
     """
     )
     ap = argparse.ArgumentParser(
@@ -58,6 +58,15 @@ def parse_args(args=None):
         action="store_true",
         help=("Use smoothed ERA5 land mask for both reanalyses"),
     )
+    ap.add_argument(
+        "--seaice-thresh",
+        type=float,
+        default=None,
+        help=(
+            "Reject tracks starting over sea-ice concentration above this value (0-1);"
+            f" only for {', '.join(SEAICE_DATASETS)}"
+        ),
+    )
 
     ag_sub = ap.add_argument_group(title="Subset")
     ag_sub.add_argument(
@@ -67,17 +76,78 @@ def parse_args(args=None):
         default=",".join([str(i) for i in bbox]),
         help=("Lon-lat bounding box (lon0,lon1,lat0,lat1)"),
     )
+    ag_sub.add_argument(
+        "--regions",
+        type=str,
+        default=None,
+        help=(
+            "Comma-separated names of regions in common_defs.regions to categorise"
+            " in one pass instead of --lonlat"
+        ),
+    )
 
     ag_etc = ap.add_argument_group(title="Other")
+    ag_etc.add_argument(
+        "--cache",
+        action="store_true",
+        help=("Read tracks using a columnar cache, creating it if necessary"),
+    )
+    ag_etc.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help=("Number of winters to read in advance in background threads (0 to disable)"),
+    )
+    ag_etc.add_argument(
+        "--compact",
+        action="store_true",
+        help=("Save track tables with compact data types (float32, int8)"),
+    )
+    add_shard_arg(ag_etc)
     ag_etc.add_argument(
         "--progressbar", action="store_true", help=("Show progress bar if available")
     )
 
-    return ap.parse_args(args)
+    args = ap.parse_args(args)
+    # Check inputs before any tracks are read
+    if args.regions is not None:
+        unknown = [name for name in args.regions.split(",") if name not in regions]
+        if unknown:
+            ap.error(f"unknown regions: {unknown}; available: {list(regions)}")
+        outside = [name for name in args.regions.split(",") if not box_inside(regions[name], bbox)]
+        if outside:
+            ap.error(f"regions outside the tracker and land mask domain {bbox}: {outside}")
+    if args.seaice_thresh is not None:
+        if args.name not in SEAICE_DATASETS:
+            ap.error(f"no sea-ice data for {args.name}; available: {SEAICE_DATASETS}")
+        if args.regions is None and not box_inside(parse_box(args.lonlat), DOMAIN):
+            ap.error(f"--lonlat is outside the sea-ice domain {DOMAIN}")
+    return args
+
+
+def parse_box(box):
+    """Convert a comma-separated lon-lat box to a list of integers."""
+    return [int(i) for i in box.split(",")]
+
+
+def box_inside(box, outer):
+    """Check if a lon-lat box (lon0, lon1, lat0, lat1) is inside another one."""
+    return outer[0] <= box[0] and box[1] <= outer[1] and outer[2] <= box[2] and box[3] <= outer[3]
+
+
+def parse_runs(runs):
+    """Convert comma- or dash-separated run numbers to a list of integers."""
+    if "-" in runs:
+        _start, _end = runs.split("-")
+        return [*range(int(_start), int(_end) + 1)]
+    else:  # if ',' in runs:
+        return [int(i) for i in runs.split(",")]
 
 
 def get_lsm(path_to_file, bbox=None, shift=False):
     """Load land-sea mask from a file and crop a region defined by `bbox`."""
+    import xarray as xr
+
     # Load land-sea mask
     lsm = xr.open_dataarray(path_to_file).squeeze()
     if shift:
@@ -97,9 +167,196 @@ def get_lsm(path_to_file, bbox=None, shift=False):
     return lsm
 
 
+def make_masks(lsm_path, outer_box, smooth=False, gen_lat_max=None):
+    """
+    Create land masks used to categorise tracks within `outer_box`.
+
+    Parameters
+    ----------
+    lsm_path: path-like
+        Path to the land-sea mask file
+    outer_box: list
+        Lon-lat bounding box (lon0, lon1, lat0, lat1)
+    smooth: bool, optional
+        Smooth the land-sea mask using `SMOOTH_FUNC`
+    gen_lat_max: float, optional
+        Northern limit of genesis; 3 degrees south of `outer_box` by default,
+        which excludes genesis over pack ice in the original domain
+
+    Returns
+    -------
+    mask: xarray.DataArray
+        Land mask with domain boundaries added
+    gen_mask: xarray.DataArray
+        Land mask with stricter domain boundaries used for the genesis criterion
+    """
+    from octant.misc import add_domain_bounds_to_mask
+    import xarray as xr
+
+    inner_box = [outer_box[0] + 1, outer_box[1] - 1, outer_box[2] + 1, outer_box[3] - 1]
+    if gen_lat_max is None:
+        gen_lat_max = outer_box[3] - 3
+    gen_box = [outer_box[0] + 1, outer_box[1] - 1, outer_box[2] + 1, gen_lat_max]
+
+    mask = get_lsm(lsm_path, bbox=outer_box, shift=True)
+    if smooth:
+        mask = xr.apply_ufunc(SMOOTH_FUNC, mask, kwargs=SMOOTH_KW)
+    mask = add_domain_bounds_to_mask(mask, inner_box)
+    # Additional constraint on genesis over sea ice covered area
+    gen_mask = add_domain_bounds_to_mask(mask, gen_box)
+    return mask, gen_mask
+
+
+def shared_criteria():
+    """Make a list of categorisation criteria that do not depend on the region."""
+    return [
+        # Mesoscale
+        lambda ot: ((ot.vortex_type != 0).sum() / ot.shape[0] < 0.2),
+        # Sensible speed
+        lambda ot: (ot.average_speed / 3.6) <= 30,
+        # Non-stationary
+        lambda ot: ot.total_dist_km >= 100.0 and ot.lifetime_h >= 3.0,
+    ]
+
+
+def region_criteria(mask, gen_mask):
+    """Make a list of categorisation criteria using land masks of a region."""
+    from octant.misc import check_by_arr_thresh, check_by_mask
+
+    # Additional arguments for land-mask function
+    # mask_func_kw = dict(lsm=mask, lmask_thresh=0.5, dist=100.0)
+    return [
+        # Far from orography and domain boundaries
+        lambda ot: check_by_mask(
+            ot,
+            None,  # Do not pass TrackRun because domain boundaries are already in `mask`
+            mask,
+            lmask_thresh=0.2,
+            time_frac=0.2,
+            dist=60.0,
+            check_domain_bounds=False,
+        ),
+        # Maritime genesis
+        lambda ot: check_by_arr_thresh(
+            ot.xs(0, level="row_idx"), arr=gen_mask, arr_thresh=0.2, oper="le", dist=120.0
+        ),
+    ]
+
+
+def make_conditions(mask, gen_mask, seaice=None):
+    """
+    Make a list of (label, list of functions) pairs for `TrackRun.classify()`.
+
+    If `seaice` (`sea_ice.SeaIceGenesis`) is given, it is added to the criteria
+    and has to be prepared for each track table before classification.
+    """
+    funcs = shared_criteria() + region_criteria(mask, gen_mask)
+    if seaice is not None:
+        # Genesis over open water
+        funcs.append(seaice)
+    return [(CAT, funcs)]
+
+
+class SharedCriteria:
+    """
+    Region-independent criteria evaluated once per track.
+
+    `prepare()` evaluates the criteria for all tracks of a track table. The instance
+    is then used as the first criterion of each region, so that only tracks that
+    passed are checked against the region masks.
+    """
+
+    def __init__(self, funcs):
+        self.funcs = funcs
+        self.allowed = set()
+
+    def prepare(self, data):
+        """Find tracks in a track table that pass all criteria."""
+        self.allowed = {i for i, ot in data.gb if all(func(ot) for func in self.funcs)}
+
+    def __call__(self, ot):
+        """Check if the track `ot` passed all criteria."""
+        return ot.index.get_level_values(0)[0] in self.allowed
+
+
+def make_region_conditions(region_masks, shared, boxes=regions, seaice=None):
+    """
+    Make a list of (label, list of functions) pairs, one for each region.
+
+    Parameters
+    ----------
+    region_masks: dict
+        Region names and (mask, gen_mask) pairs from `make_masks()`
+    shared: SharedCriteria
+        Region-independent criteria
+    boxes: dict, optional
+        Lon-lat boxes of the regions
+    seaice: sea_ice.SeaIceGenesis, optional
+        Sea-ice criterion included in `shared`, if any
+
+    Returns
+    -------
+    list
+        Conditions for `TrackRun.classify()` with inclusive=False, labelled as "pmc_<region>"
+
+    Raises
+    ------
+    ValueError
+        If a region is not covered by its land mask or by the sea-ice cube
+    """
+    uncovered = []
+    for name, (mask, _) in region_masks.items():
+        if not grid_covers_box(mask.longitude.values, mask.latitude.values, boxes[name]):
+            uncovered.append(f"{name} (land mask)")
+        if seaice is not None and not seaice.cube.covers_box(boxes[name]):
+            uncovered.append(f"{name} (sea-ice cube)")
+    if uncovered:
+        raise ValueError(f"Regions not covered by input data: {', '.join(uncovered)}")
+    return [
+        (f"{CAT}_{name}", [shared] + region_criteria(mask, gen_mask))
+        for name, (mask, gen_mask) in region_masks.items()
+    ]
+
+
+def load_winter(track_res_dir, use_cache=False):
+    """Load tracks from one directory."""
+    from octant.core import TrackRun
+
+    if use_cache:
+        return load_tracks(track_res_dir, columns=columns)
+    else:
+        return TrackRun(track_res_dir, columns=columns)
+
+
+def classify_winter(_tr, conditions, seaice=None, shared=None, inclusive=True):
+    """
+    Classify tracks in place according to `conditions`.
+
+    `seaice` and `shared` criteria are prepared for the track table first, if given.
+    """
+    logger.debug(f"TrackRun size: {len(_tr)}")
+    if len(_tr) > 0:
+        if seaice is not None:
+            # Look up sea ice at all genesis points at once
+            seaice.prepare(_tr.data)
+        if shared is not None:
+            shared.prepare(_tr.data)
+        logger.info("Begin classification")
+        _tr.classify(conditions, inclusive)
+    return _tr
+
+
+def categorise_winter(track_res_dir, conditions, use_cache=False, seaice=None):
+    """Load tracks from one directory and classify them according to `conditions`."""
+    _tr = load_winter(track_res_dir, use_cache=use_cache)
+    return classify_winter(_tr, conditions, seaice=seaice)
+
+
 def main(args=None):
     """Loop over track runs and categorise them according `cat_kw`."""
     args = parse_args(args)
+    from octant.core import TrackRun
+    from octant.decor import get_pbar
 
     if args.progressbar:
         from octant import RUNTIME
@@ -107,72 +364,70 @@ def main(args=None):
         RUNTIME.enable_progress_bar = True
     pbar = get_pbar()
 
-    if "-" in args.runs:
-        _start, _end = args.runs.split("-")
-        runs = [*range(int(_start), int(_end) + 1)]
-    else:  # if ',' in args.runs:
-        runs = [int(i) for i in args.runs.split(",")]
-    runs2process = {args.name: runs}
-
-    outer_box = [int(i) for i in args.lonlat.split(",")]
-    inner_box = [outer_box[0] + 1, outer_box[1] - 1, outer_box[2] + 1, outer_box[3] - 1]
-    gen_box = [outer_box[0] + 1, outer_box[1] - 1, outer_box[2] + 1, outer_box[3] - 3]
+    runs2process = {args.name: parse_runs(args.runs)}
 
-    if args.betterlandmask:
-        mask = get_lsm(lsm_paths["era5"], bbox=outer_box, shift=True)
-        mask = xr.apply_ufunc(SMOOTH_FUNC, mask, kwargs=SMOOTH_KW)
-        mask = add_domain_bounds_to_mask(mask, inner_box)
-        # Additional constraint on genesis over sea ice covered area
-        gen_mask = add_domain_bounds_to_mask(mask, gen_box)
+    lsm_path = lsm_paths["era5" if args.betterlandmask else args.name]
+    seaice = None
+    if args.seaice_thresh is not None:
+        seaice = SeaIceGenesis(SeaIceCube(args.name), thresh=args.seaice_thresh)
+    if args.regions is None:
+        outer_box = parse_box(args.lonlat)
+        mask, gen_mask = make_masks(lsm_path, outer_box, smooth=args.betterlandmask)
+        conditions = make_conditions(mask, gen_mask, seaice=seaice)
+        shared = None
+        suffix = ""
     else:
-        mask = get_lsm(lsm_paths[args.name], bbox=outer_box, shift=True)
-    lon2d, lat2d = np.meshgrid(mask.longitude, mask.latitude)
+        # Masks of all regions are made once; tracks of each winter are loaded once
+        # and checked against region-independent criteria once
+        region_names = args.regions.split(",")
+        region_masks = {
+            name: make_masks(
+                lsm_path,
+                regions[name],
+                smooth=args.betterlandmask,
+                gen_lat_max=region_gen_lat_max[name],
+            )
+            for name in region_names
+        }
+        shared = SharedCriteria(shared_criteria() + ([seaice] if seaice is not None else []))
+        conditions = make_region_conditions(region_masks, shared, seaice=seaice)
+        suffix = "_regions"
 
-    # Additional arguments for land-mask function
-    # mask_func_kw = dict(lsm=mask, lmask_thresh=0.5, dist=100.0)
-    conditions = [
-        (
-            "pmc",
-            [
-                # Mesoscale
-                lambda ot: ((ot.vortex_type != 0).sum() / ot.shape[0] < 0.2),
-                # Sensible speed
-                lambda ot: (ot.average_speed / 3.6) <= 30,
-                # Non-stationary
-                lambda ot: ot.total_dist_km >= 100.0 and ot.lifetime_h >= 3.0,
-                # Far from orography and domain boundaries
-                lambda ot: check_by_mask(
-                    ot,
-                    None,  # Do not pass TrackRun because domain boundaries are already in `mask`
-                    mask,
-                    lmask_thresh=0.2,
-                    time_frac=0.2,
-                    dist=60.0,
-                    check_domain_bounds=False,
-                ),
-                # Maritime genesis
-                lambda ot: check_by_arr_thresh(
-                    ot.xs(0, level="row_idx"), arr=gen_mask, arr_thresh=0.2, oper="le", dist=120.0
-                ),
-            ],
-        )
+    work = [
+        (dset, run_num, winter)
+        for dset, run_nums in runs2process.items()
+        for run_num in run_nums
+        for winter in winters
     ]
+    if args.shard is not None:
+        # Categorise only a part of (dataset, run, winter) combinations
+        # and save each winter separately; see merge_shards.py
+        SHARD_DIR.mkdir(parents=True, exist_ok=True)
+        work = select_shard(work, args.shard)
+
+    def _load(item):
+        dset, run_num, winter = item
+        track_res_dir = mypaths.trackresdir / dset / f"run{run_num:03d}" / winter
+        return load_winter(track_res_dir, use_cache=args.cache)
 
-    for dset, run_nums in pbar(runs2process.items()):  # , desc="dset"):
-        for run_num in pbar(run_nums):  # , leave=False, desc="run_num"):
-            logger.info(run_num)
+    # Next winters are read in the background while the current one is classified
+    full_tr = TrackRun()
+    for (dset, run_num, winter), _tr in pbar(prefetch(_load, work, n_ahead=args.prefetch)):
+        logger.info(f"{dset}, {run_num}, winter: {winter}")
+        classify_winter(_tr, conditions, seaice=seaice, shared=shared, inclusive=shared is None)
+        if args.shard is not None:
+            if args.compact:
+                _tr = compact_trackrun(_tr, n_cat_bits=len(conditions))
+            _tr.to_archive(categorised_path(dset, run_num, winter, suffix=suffix))
+            continue
+        full_tr += _tr
+        if winter == winters[-1]:
+            out_path = mypaths.procdir / f"{dset}_run{run_num:03d}_{period}{suffix}.h5"
+            if args.compact:
+                full_tr = compact_trackrun(full_tr, n_cat_bits=len(conditions))
+            full_tr.to_archive(out_path)
+            save_time_index(out_path, build_time_index(full_tr.data))
             full_tr = TrackRun()
-            for winter in pbar(winters):  # , desc="winter", leave=False):
-                logger.info(f"winter: {winter}")
-                track_res_dir = mypaths.trackresdir / dset / f"run{run_num:03d}" / winter
-                _tr = TrackRun(track_res_dir, columns=columns)
-                logger.debug(f"TrackRun size: {len(_tr)}")
-                if len(_tr) > 0:
-                    logger.info("Begin classification")
-                    _tr.classify(conditions, True)
-                full_tr += _tr
-
-            full_tr.to_archive(mypaths.procdir / f"{dset}_run{run_num:03d}_{period}.h5")
 
 
 if __name__ == "__main__":
@@ -6,16 +6,24 @@ import calendar
 
 import numpy as np
 
-from scipy.ndimage.filters import gaussian_filter
-
 
 # Categorisation
 CAT = "pmc"
 
+
 # Smoothing
-SMOOTH_FUNC = gaussian_filter
+def SMOOTH_FUNC(*args, **kwargs):
+    """Gaussian filter from `scipy.ndimage`, imported on first use."""
+    from scipy.ndimage import gaussian_filter
+
+    return gaussian_filter(*args, **kwargs)
+
+
 SMOOTH_KW = {"sigma": (1.2, 4.5)}
 
+# Mean radius of the Earth [km]
+EARTH_RADIUS = 6371.009
+
 # Columns of vortrack text files
 columns = ["lon", "lat", "vo", "time", "area", "vortex_type", "slp"]
 
@@ -54,6 +62,15 @@ month_weights = 30 / ndays_per_month_total
 bbox = [-21, 51, 64, 86]
 # Additional bbox, equivalent to TrackRun.conf.extent
 inner_bbox = [-20, 50, 65, 85]
+# Named subdomains for multi-region categorisation (lon0, lon1, lat0, lat1)
+# They have to be inside bbox, which the tracker output and land masks cover
+regions = {
+    "nordic_seas": [-21, 21, 64, 82],
+    "barents_sea": [15, 51, 68, 82],
+}
+# Northern limit of genesis in each region, 3 degrees south of its northern
+# boundary as in the original domain, to exclude genesis over pack ice
+region_gen_lat_max = {"nordic_seas": 79, "barents_sea": 79}
 
 # Geographical names to put on map plots
 toponyms = [
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Compact in-memory representation of track tables.
+
+Coordinates and other fields are stored as float32, vortex type as int8
+and the category bit mask as the smallest unsigned integer type with one bit
+for each category that can be assigned, so that a later classification
+does not overflow it. For holding many runs in memory, the (track_idx, row_idx)
+index can be replaced by a flat array of int32 track offsets (see `to_columns`).
+"""
+import copy
+
+from loguru import logger
+
+import numpy as np
+
+import pandas as pd
+
+from track_io import index_to_offsets, replace_data, to_frame
+
+
+FLOAT_COLUMNS = ["lon", "lat", "vo", "area", "slp"]
+INT_COLUMNS = {"vortex_type": np.int8}
+# Default number of category bits, i.e. categories that can be assigned after compaction
+CAT_BITS = 8
+
+
+def cat_dtype(n_bits):
+    """Smallest unsigned integer type with at least `n_bits` bits."""
+    for dtype in [np.uint8, np.uint16, np.uint32, np.uint64]:
+        if np.iinfo(dtype).bits >= n_bits:
+            return np.dtype(dtype)
+    raise ValueError(f"Too many category bits: {n_bits}")
+
+
+def compact_frame(df, n_cat_bits=CAT_BITS):
+    """
+    Convert columns of a track table to compact data types.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Track table
+    n_cat_bits: int, optional
+        Number of categories that the category column should hold,
+        e.g. the number of conditions passed to `TrackRun.classify()`
+
+    Returns
+    -------
+    pandas.DataFrame
+        Track table with float32 fields, int8 vortex type and the smallest
+        unsigned integer type with `n_cat_bits` bits for the category column
+    """
+    dtypes = {col: np.float32 for col in FLOAT_COLUMNS if col in df.columns}
+    dtypes.update({col: dt for col, dt in INT_COLUMNS.items() if col in df.columns})
+    if "cat" in df.columns:
+        # Categories already assigned must fit as well
+        max_cat = max(int(df["cat"].max()), 0) if df.shape[0] else 0
+        dtypes["cat"] = cat_dtype(max(n_cat_bits, max_cat.bit_length()))
+    return df.astype(dtypes)
+
+
+def compact_trackrun(tr, n_cat_bits=CAT_BITS):
+    """Make a copy of a `TrackRun` with a compact track table."""
+    return replace_data(tr, compact_frame(tr.data, n_cat_bits=n_cat_bits))
+
+
+def to_columns(data, compact=True, n_cat_bits=CAT_BITS):
+    """
+    Convert a track table to columnar arrays with int32 track offsets instead of an index.
+
+    Returns
+    -------
+    columns: dict
+        Dictionary of numpy arrays, one for each column
+    offsets: numpy.ndarray
+        Row offsets of tracks (int32)
+    track_ids: numpy.ndarray
+        Track indices (int32)
+    """
+    if compact:
+        data = compact_frame(data, n_cat_bits=n_cat_bits)
+    offsets, track_ids = index_to_offsets(data.index)
+    columns = {col: data[col].values for col in data.columns}
+    return columns, offsets.astype(np.int32), track_ids.astype(np.int32)
+
+
+def from_columns(columns, offsets, track_ids=None):
+    """Make a track table with a (track_idx, row_idx) index from columnar arrays."""
+    return to_frame(columns, offsets, track_ids=track_ids)
+
+
+def columns_memory_mb(columns, offsets, track_ids):
+    """Memory used by a track table in the columnar layout [MB]."""
+    return sum(arr.nbytes for arr in [*columns.values(), offsets, track_ids]) / 1024 ** 2
+
+
+def memory_usage_mb(data):
+    """Memory used by a track table, including the index [MB]."""
+    return pd.DataFrame(data).memory_usage(index=True, deep=True).sum() / 1024 ** 2
+
+
+def check_compact(tr, conditions=None, obs_tracks=None, match_kwargs=None, time_dict=None):
+    """
+    Check that classification and matching give the same results for a compact `TrackRun`.
+
+    Parameters
+    ----------
+    tr: octant.core.TrackRun
+        Track run with full-precision data
+    conditions: list, optional
+        Conditions for `TrackRun.classify()`. If not given, classification is not checked.
+    obs_tracks: list, optional
+        Reference tracks. If not given, matching is not checked.
+    match_kwargs: dict, optional
+        Matching options passed to `match_to_ref.match_run()`
+    time_dict: dict, optional
+        Winter names and dates passed to `match_to_ref.match_run()`
+
+    Returns
+    -------
+    dict
+        Results of the checks and memory used by the full and compact track tables
+        and by the compact columnar layout
+    """
+    n_cat_bits = max(CAT_BITS, len(conditions)) if conditions is not None else CAT_BITS
+    full = copy.deepcopy(tr)
+    small = compact_trackrun(copy.deepcopy(tr), n_cat_bits=n_cat_bits)
+    columnar = to_columns(small.data, compact=False)
+    result = dict(
+        full_mb=memory_usage_mb(full.data),
+        compact_mb=memory_usage_mb(small.data),
+        columnar_mb=columns_memory_mb(*columnar),
+        same_columnar=bool(from_columns(*columnar).equals(pd.DataFrame(small.data))),
+    )
+    if conditions is not None:
+        full.classify(conditions, True)
+        small.classify(conditions, True)
+        same = full.data["cat"].values == small.data["cat"].values
+        result["same_categories"] = bool(same.all())
+    if obs_tracks is not None:
+        from match_to_ref import match_run
+
+        pairs_full = match_run(full, obs_tracks, match_kwargs or {}, time_dict)
+        pairs_small = match_run(small, obs_tracks, match_kwargs or {}, time_dict)
+        result["same_matches"] = sorted(pairs_full) == sorted(pairs_small)
+    for key in ["same_columnar", "same_categories", "same_matches"]:
+        if not result.get(key, True):
+            logger.warning(f"Compact track table changes the results: {key} is False")
+    return result
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Density maps of tracks for each winter computed in one pass over track points.
+
+Every track point is assigned a winter by binary search in `winter_dates` and
+a grid cell by binary search in the cell edges. Point, track, genesis and lysis
+counts of all winters are then made by a single `numpy.bincount` over flat
+(winter, density type, latitude, longitude) indices. The resulting cube is
+saved to netCDF in chunks of one winter, so that the climatology, standard
+deviation, anomalies and significance tests are all computed from the same file.
+"""
+import argparse
+from pathlib import Path
+import sys
+from textwrap import dedent
+
+from loguru import logger as L
+
+import numpy as np
+
+from archive_cache import archive_path, load_trackrun
+from common_defs import CAT, EARTH_RADIUS, inner_bbox, period, winter_dates
+import mypaths
+from track_io import MUX_NAMES
+
+SCRIPT = Path(__file__).name
+DENSITY_TYPES = ["point", "track", "genesis", "lysis"]
+
+
+def parse_args(args=None):
+    """Parse command line arguments."""
+    epilog = dedent(
+        f"""Example of use:
+    ./{SCRIPT} -n era5 -r 0 --step 0.5
+    """
+    )
+    ap = argparse.ArgumentParser(
+        SCRIPT,
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog=epilog,
+    )
+    ap.add_argument(
+        "-n",
+        "--name",
+        type=str,
+        required=True,
+        choices=["era5", "interim"],
+        help="Name of the dataset",
+    )
+    ap.add_argument("-r", "--run", type=int, default=0, help="Run number")
+    ap.add_argument("--subset", type=str, default=CAT, help="Subset of tracks")
+    ap.add_argument("--step", type=float, default=0.5, help="Grid spacing [deg]")
+    ap.add_argument("--force", action="store_true", help="Recompute even if the file exists")
+    return ap.parse_args(args)
+
+
+def grid_str(step):
+    """Label of a grid spacing used in file names, e.g. 0p5deg."""
+    return f"{step:g}deg".replace(".", "p")
+
+
+def cube_path(dset, run_id, subset=CAT, step=0.5):
+    """Path to a saved density cube."""
+    fname = f"dens_cube_{dset}_run{run_id:03d}_{period}_{subset}_{grid_str(step)}.nc"
+    return mypaths.procdir / fname
+
+
+def winter_index(times, dates=winter_dates):
+    """
+    Assign winters to an array of times by binary search.
+
+    Returns
+    -------
+    numpy.ndarray
+        Index of the winter in `dates` containing each time, -1 if none
+    """
+    bounds = np.array([[np.datetime64(i, "ns") for i in v] for v in dates.values()])
+    # End dates are inclusive
+    starts, ends = bounds[:, 0], bounds[:, 1] + np.timedelta64(1, "D")
+    idx = np.searchsorted(starts, times.astype("datetime64[ns]"), side="right") - 1
+    ok = (idx >= 0) & (times < ends[np.maximum(idx, 0)])
+    return np.where(ok, idx, -1)
+
+
+def _cell_edges(centres):
+    """Edges of grid cells given their centres."""
+    mid = (centres[1:] + centres[:-1]) / 2
+    return np.concatenate([[2 * centres[0] - mid[0]], mid, [2 * centres[-1] - mid[-1]]])
+
+
+def cell_area(lon1d, lat1d):
+    """Area [km^2] of grid cells with centres at `lon1d`, `lat1d`."""
+    lon_e, lat_e = np.deg2rad(_cell_edges(lon1d)), np.deg2rad(_cell_edges(lat1d))
+    return EARTH_RADIUS ** 2 * np.outer(np.abs(np.diff(np.sin(lat_e))), np.abs(np.diff(lon_e)))
+
+
+def density_counts(data, lon1d, lat1d, dates=winter_dates):
+    """
+    Count track points, tracks, genesis and lysis points per grid cell and winter.
+
+    Parameters
+    ----------
+    data: pandas.DataFrame
+        Track table with a (track_idx, row_idx) index sorted by track_idx
+    lon1d, lat1d: numpy.ndarray
+        Increasing coordinates of grid cell centres
+    dates: dict, optional
+        Winter names and (start, end) dates
+
+    Returns
+    -------
+    numpy.ndarray
+        Counts of shape (winter, density type, latitude, longitude)
+    """
+    n_w, n_t, n_y, n_x = len(dates), len(DENSITY_TYPES), lat1d.shape[0], lon1d.shape[0]
+    track = data.index.get_level_values(MUX_NAMES[0]).values
+    winter = winter_index(data["time"].values, dates=dates)
+    ix = np.searchsorted(_cell_edges(lon1d), data["lon"].values, side="right") - 1
+    iy = np.searchsorted(_cell_edges(lat1d), data["lat"].values, side="right") - 1
+    ok = (winter >= 0) & (ix >= 0) & (ix < n_x) & (iy >= 0) & (iy < n_y)
+    # Flat index of (winter, latitude, longitude) of each point, -1 if outside
+    cell = np.where(ok, (winter * n_y + iy) * n_x + ix, -1)
+
+    is_first = np.ones(track.shape, dtype=bool)
+    is_first[1:] = track[1:] != track[:-1]
+    is_last = np.ones(track.shape, dtype=bool)
+    is_last[:-1] = is_first[1:]
+    # Each track is counted once in each cell it passes through
+    _, is_new_cell = np.unique(np.stack([track, cell]), axis=1, return_index=True)
+
+    idx = {
+        "point": cell,
+        "track": cell[is_new_cell],
+        "genesis": cell[is_first],
+        "lysis": cell[is_last],
+    }
+    flat = []
+    for k, dens_type in enumerate(DENSITY_TYPES):
+        sel = idx[dens_type][idx[dens_type] >= 0]
+        # Insert the density type dimension after the winter one
+        w, yx = np.divmod(sel, n_y * n_x)
+        flat.append((w * n_t + k) * n_y * n_x + yx)
+    counts = np.bincount(np.concatenate(flat), minlength=n_w * n_t * n_y * n_x)
+    return counts.reshape(n_w, n_t, n_y, n_x)
+
+
+def density_cube(data, lon1d, lat1d, dates=winter_dates):
+    """
+    Density of tracks per winter in cells of the grid, per km^2.
+
+    Returns
+    -------
+    xarray.DataArray
+        Array with dimensions (winter, dens_type, latitude, longitude)
+    """
+    import xarray as xr
+
+    counts = density_counts(data, lon1d, lat1d, dates=dates)
+    return xr.DataArray(
+        counts / cell_area(lon1d, lat1d),
+        dims=("winter", "dens_type", "latitude", "longitude"),
+        coords=dict(winter=list(dates), dens_type=DENSITY_TYPES, latitude=lat1d, longitude=lon1d),
+        name="density",
+        attrs=dict(units="km-2", method="cell"),
+    )
+
+
+def save_cube(cube, path):
+    """Save a density cube to netCDF in chunks of one winter."""
+    chunks = (1,) + cube.shape[1:]
+    cube.to_netcdf(path, encoding={cube.name: dict(chunksizes=chunks, zlib=True)})
+
+
+def load_cube(path, chunked=True):
+    """Open a saved density cube, as a dask array with one winter per chunk if `chunked`."""
+    import xarray as xr
+
+    return xr.open_dataarray(path, chunks=dict(winter=1) if chunked else None)
+
+
+def get_cube(dset, run_id, subset=CAT, step=0.5, box=inner_bbox, force=False):
+    """
+    Load the density cube of a run, computing and saving it if necessary.
+
+    Parameters
+    ----------
+    dset: str
+        Name of the dataset
+    run_id: int
+        Run number
+    subset: str, optional
+        Subset of tracks
+    step: float, optional
+        Grid spacing [deg]
+    box: list, optional
+        Lon-lat extent of the grid (lon0, lon1, lat0, lat1)
+    force: bool, optional
+        Recompute the cube even if it has been saved
+
+    Returns
+    -------
+    xarray.DataArray
+    """
+    path = cube_path(dset, run_id, subset=subset, step=step)
+    if force or not path.exists():
+        lon1d = np.arange(box[0], box[1] + step / 10, step)
+        lat1d = np.arange(box[2], box[3] + step / 10, step)
+        data = load_trackrun(
+            archive_path(dset, run_id), subset=subset, columns=["lon", "lat", "time", "cat"]
+        ).data
+        save_cube(density_cube(data, lon1d, lat1d), path)
+        L.info(f"Saved to {path}")
+    return load_cube(path)
+
+
+def climatology(cube):
+    """Mean and standard deviation across winters."""
+    return cube.mean("winter"), cube.std("winter", ddof=1)
+
+
+def anomalies(cube):
+    """Deviations of each winter from the mean across winters."""
+    return cube - cube.mean("winter")
+
+
+def difference_significance(cube_a, cube_b, alpha=0.05):
+    """
+    Mask of grid cells where the mean densities of two cubes differ significantly.
+
+    Uses Welch's t-test with winters as samples.
+    """
+    from scipy import stats
+
+    _, pvalue = stats.ttest_ind(
+        cube_a.values, cube_b.values, axis=cube_a.get_axis_num("winter"), equal_var=False
+    )
+    return cube_a.isel(winter=0, drop=True).copy(data=pvalue < alpha).rename("significant")
+
+
+def trend_significance(cube, alpha=0.05):
+    """
+    Linear trend across winters [per winter] and the mask of cells where it is significant.
+
+    The least-squares slopes and their t-statistics are computed for all cells at once,
+    for a cube with any dimensions besides winter.
+    """
+    from scipy import stats
+
+    n = cube.sizes["winter"]
+    x = np.arange(n) - (n - 1) / 2
+    y = cube.transpose("winter", ...).values
+    slope = np.tensordot(x, y - y.mean(axis=0), axes=1) / (x ** 2).sum()
+    # Broadcast winters along the first axis
+    resid = y - y.mean(axis=0) - x.reshape((-1,) + (1,) * (y.ndim - 1)) * slope
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stderr = np.sqrt((resid ** 2).sum(axis=0) / (n - 2) / (x ** 2).sum())
+        pvalue = 2 * stats.t.sf(np.abs(slope / stderr), n - 2)
+    template = cube.isel(winter=0, drop=True)
+    return template.copy(data=slope).rename("trend"), template.copy(data=pvalue < alpha)
+
+
+def main(args=None):
+    """Compute and save the density cube of a run."""
+    args = parse_args(args)
+    cube = get_cube(args.name, args.run, subset=args.subset, step=args.step, force=args.force)
+    L.info(cube)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,16 @@
 #!/usr/bin/env python3
 import cdsapi
 
-import mypaths
+from sea_ice import DOMAIN, download_area, seaice_path
 
-AREA = "90/-30/60/60"
-TOPDIR = mypaths.ra_dir
+# Same area as the sea-ice cube of sea_ice.py
+AREA = download_area(DOMAIN)
 PRODUCT_NAME = "era5"
 
 
 if __name__ == "__main__":
-    outdir = TOPDIR / PRODUCT_NAME
-    outdir.mkdir(exist_ok=True)
-    fname = f"{PRODUCT_NAME}.an.sfc.2000-2018.sea_ice_cover.nc"
-    target = str(outdir / fname)
+    target = seaice_path(PRODUCT_NAME)
+    target.parent.mkdir(exist_ok=True)
 
     c = cdsapi.Client()
 
@@ -80,5 +78,5 @@ if __name__ == "__main__":
             "area": AREA,
             "format": "netcdf",
         },
-        fname,
+        str(target),
     )
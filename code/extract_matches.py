@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Extract matched tracks of many runs and matching options into one archive."""
+import argparse
+from pathlib import Path
+import sys
+from textwrap import dedent
+
+from loguru import logger as L
+
+import numpy as np
+
+import pandas as pd
+
+from archive_cache import archive_path, load_trackrun
+from categorise_and_save import parse_runs
+from common_defs import period
+from match_to_ref import REF_DATASETS, _make_match_label, match_options
+import mypaths
+from shards import SHARD_DIR, add_shard_arg, partial_path, select_shard
+
+SCRIPT = Path(__file__).name
+
+
+def parse_args(args=None):
+    """Parse command line arguments."""
+    epilog = dedent(
+        f"""Example of use:
+    ./{SCRIPT} -n era5 --runs 0-10 --ref stars
+    """
+    )
+    ap = argparse.ArgumentParser(
+        SCRIPT,
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog=epilog,
+    )
+    ap.add_argument(
+        "-n",
+        "--name",
+        type=str,
+        required=True,
+        choices=["era5", "interim"],
+        help="Name of the dataset",
+    )
+    ap.add_argument(
+        "-r",
+        "--runs",
+        type=str,
+        required=True,
+        help="Run numbers, comma- or dash-separated (inclusive range)",
+    )
+    ap.add_argument(
+        "--ref", type=str, default="stars", choices=[*REF_DATASETS], help="Reference dataset"
+    )
+    ap.add_argument("-o", "--output", type=str, default=None, help="Output file")
+    add_shard_arg(ap)
+    return ap.parse_args(args)
+
+
+def match_file(dset, run_id, ref_name, match_kwargs):
+    """Path to a text file with matching pairs written by `match_to_ref`."""
+    label = _make_match_label(match_kwargs)
+    return mypaths.procdir / "matches" / f"{dset}_run{run_id:03d}_{period}_{ref_name}_{label}.txt"
+
+
+def read_matches(path, names=("track_idx", "ref_idx")):
+    """Read matching pairs from a text file into a `pandas.DataFrame`."""
+    return pd.read_csv(path, comment="#", names=list(names), dtype=int)
+
+
+def take_tracks(data, track_ids):
+    """
+    Select whole tracks from a track table using positional indexing.
+
+    Parameters
+    ----------
+    data: pandas.DataFrame
+        Track table with a (track_idx, row_idx) index sorted by track_idx
+    track_ids: array-like
+        Track indices to select, in the order of output. Can have repeated values.
+
+    Returns
+    -------
+    taken: pandas.DataFrame
+        Selected rows
+    counts: numpy.ndarray
+        Number of rows of each selected track
+    """
+    level = data.index.get_level_values(0).values
+    track_ids = np.asarray(track_ids)
+    starts = np.searchsorted(level, track_ids, side="left")
+    counts = np.searchsorted(level, track_ids, side="right") - starts
+    # Concatenate ranges [start, start + count) for all tracks
+    pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+    return data.take(pos), counts
+
+
+def extract_matched(tr, matches, ref_col="ref_idx"):
+    """
+    Select tracks of a `TrackRun` that have a match and attach the matched reference IDs.
+
+    Parameters
+    ----------
+    tr: octant.core.TrackRun
+        Track run containing tracks in the first column of `matches`
+    matches: pandas.DataFrame
+        Two-column table of matching pairs, e.g. read by `read_matches`.
+        The second column can be the reference track number or the track index
+        in another `TrackRun`, e.g. when matching ERA5 to ERA-Interim.
+    ref_col: str, optional
+        Name of the new column with reference IDs
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    data = tr.data
+    if not data.index.is_monotonic_increasing:
+        data = data.sort_index()
+    track_ids, ref_ids = matches.values[:, 0], matches.values[:, 1]
+    taken, counts = take_tracks(data, track_ids)
+    taken = pd.DataFrame(taken)
+    taken[ref_col] = np.repeat(ref_ids, counts)
+    return taken
+
+
+def _store_key(dset, run_id, match_kwargs):
+    label = _make_match_label(match_kwargs).replace("=", "_").replace(".", "p")
+    return f"/{dset}_run{run_id:03d}/{label}"
+
+
+def extract_all(dset, work, ref_name, out_path):
+    """
+    Extract matched tracks for several runs and matching options and save them to one file.
+
+    Parameters
+    ----------
+    dset: str
+        Name of the dataset
+    work: list
+        List of (run number, matching option) pairs
+    ref_name: str
+        Name of the reference dataset
+    out_path: path-like
+        Output file. Each subset is stored under "/{dset}_run{NNN}/{matching option}".
+    """
+    ref_col = f"{ref_name}_N"
+    with pd.HDFStore(out_path, mode="w") as store:
+        for run_id, match_kwargs in work:
+            tr = load_trackrun(archive_path(dset, run_id))
+            matches = read_matches(match_file(dset, run_id, ref_name, match_kwargs))
+            df = extract_matched(tr, matches, ref_col=ref_col)
+            key = _store_key(dset, run_id, match_kwargs)
+            L.debug(f"{key}: {matches.shape[0]} pairs, {df.shape[0]} points")
+            store.put(key, df.reset_index())
+            store.get_storer(key).attrs.metadata = dict(
+                dataset=dset, run_id=run_id, ref=ref_name, match=match_kwargs
+            )
+
+
+def main(args=None):
+    """Save matched tracks of selected runs to an HDF5 file."""
+    args = parse_args(args)
+    if args.output is None:
+        out_path = mypaths.procdir / f"{args.name}_{period}__matched_to_{args.ref}.h5"
+    else:
+        out_path = Path(args.output)
+    work = [(run_id, kw) for run_id in parse_runs(args.runs) for kw in match_options]
+    if args.shard is not None:
+        SHARD_DIR.mkdir(parents=True, exist_ok=True)
+        out_path = partial_path(out_path, args.shard)
+    extract_all(args.name, select_shard(work, args.shard), args.ref, out_path)
+    L.info(f"Saved to {out_path}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
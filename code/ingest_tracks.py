@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Parse tracker output of selected runs and save it to columnar caches."""
+import argparse
+from pathlib import Path
+import sys
+from textwrap import dedent
+
+from loguru import logger
+
+from categorise_and_save import parse_runs
+from common_defs import columns, winters
+import mypaths
+from shards import add_shard_arg, select_shard
+from track_io import ingest_dir
+
+SCRIPT = Path(__file__).name
+
+
+def parse_args(args=None):
+    """Parse command line arguments."""
+    epilog = dedent(
+        f"""Example of use:
+    ./{SCRIPT} -n era5 --runs 0-10
+    """
+    )
+    ap = argparse.ArgumentParser(
+        SCRIPT,
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog=epilog,
+    )
+    ap.add_argument(
+        "-n",
+        "--name",
+        type=str,
+        required=True,
+        choices=["era5", "interim"],
+        help="Name of the dataset",
+    )
+    ap.add_argument(
+        "-r",
+        "--runs",
+        type=str,
+        required=True,
+        help="Run numbers, comma- or dash-separated (inclusive range)",
+    )
+    ap.add_argument("--force", action="store_true", help="Rebuild caches even if up to date")
+    add_shard_arg(ap)
+    return ap.parse_args(args)
+
+
+def main(args=None):
+    """Create columnar caches for all winters of the selected runs."""
+    args = parse_args(args)
+    work = [(run_num, winter) for run_num in parse_runs(args.runs) for winter in winters]
+    for run_num, winter in select_shard(work, args.shard):
+        track_res_dir = mypaths.trackresdir / args.name / f"run{run_num:03d}" / winter
+        data, offsets = ingest_dir(track_res_dir, columns=columns, use_cache=not args.force)
+        logger.info(f"{track_res_dir}: {offsets.shape[0] - 1} tracks, {offsets[-1]} points")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
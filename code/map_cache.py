@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Map backgrounds with projected coastlines cached on disk.
+
+Drawing the coastlines with `cartopy` projects and clips the Natural Earth
+polygons every time an axes is drawn. Here the land polygons are projected to
+the map projection once for each combination of projection, extent and scale,
+converted to matplotlib paths and pickled. Every subsequent panel, in the same
+or another process, only adds a ready-made `PathCollection`.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import pickle
+
+from loguru import logger
+
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+from cartopy.mpl.patch import geos_to_path
+
+from matplotlib.collections import PathCollection
+
+import numpy as np
+
+from shapely.geometry import box as shapely_box
+
+from common_defs import toponyms as TOPONYMS
+import mypaths
+from plot_utils import COAST, clat, clon, extent
+
+CACHE_DIR = mypaths.procdir / "map_cache"
+# Margin [degrees] added to the extent when clipping coastlines
+PAD = 5
+
+
+def lcc_projection(clon=clon, clat=clat):
+    """Lambert Conformal projection centred at (clon, clat)."""
+    return ccrs.LambertConformal(central_longitude=clon, central_latitude=clat)
+
+
+def _cache_path(clon, clat, extent, scale):
+    return CACHE_DIR / f"lcc_{clon}_{clat}_{'_'.join(str(i) for i in extent)}_{scale}.pkl"
+
+
+@lru_cache(maxsize=8)
+def coast_paths(clon=clon, clat=clat, extent=tuple(extent), scale=COAST["scale"]):
+    """
+    Land polygons projected to the LCC projection as a list of `matplotlib.path.Path`.
+
+    The paths are read from the disk cache, or created and saved there.
+    """
+    path = _cache_path(clon, clat, extent, scale)
+    if path.exists():
+        with path.open("rb") as fin:
+            return pickle.load(fin)
+
+    logger.info(f"Projecting {scale} coastlines to {path.name}")
+    proj = lcc_projection(clon, clat)
+    lon0, lon1, lat0, lat1 = extent[0] - PAD, extent[1] + PAD, extent[2] - PAD, extent[3] + PAD
+    clip = shapely_box(lon0, lat0, lon1, lat1)
+    land = cfeature.NaturalEarthFeature("physical", "land", scale)
+    paths = []
+    for geom in land.intersecting_geometries([lon0, lon1, lat0, lat1]):
+        geom = geom.intersection(clip)
+        if not geom.is_empty:
+            paths.extend(geos_to_path(proj.project_geometry(geom, ccrs.PlateCarree())))
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("wb") as fout:
+        pickle.dump(paths, fout)
+    tmp.replace(path)
+    return paths
+
+
+@lru_cache(maxsize=8)
+def toponym_positions(clon=clon, clat=clat):
+    """Projected coordinates of `common_defs.toponyms`."""
+    lon = np.array([i["lon"] for i in TOPONYMS], dtype=float)
+    lat = np.array([i["lat"] for i in TOPONYMS], dtype=float)
+    return lcc_projection(clon, clat).transform_points(ccrs.PlateCarree(), lon, lat)[:, :2]
+
+
+def add_background(ax, clon=clon, clat=clat, extent=extent, coast=COAST, toponyms=False):
+    """
+    Set the extent of an LCC `GeoAxes` and add cached coastlines and, optionally, toponyms.
+
+    Parameters
+    ----------
+    ax: cartopy.mpl.geoaxes.GeoAxes
+        Axes with `lcc_projection(clon, clat)`
+    clon, clat: float, optional
+        Centre of the projection
+    extent: list, optional
+        Lon-lat extent of the map (lon0, lon1, lat0, lat1)
+    coast: dict, optional
+        Scale and style of the land polygons, like `plot_utils.COAST`
+    toponyms: bool or dict, optional
+        Add geographical names; if a dict, it is passed to `ax.text()`
+    """
+    ax.set_extent(extent, crs=ccrs.PlateCarree())
+    if coast:
+        style = {k: v for k, v in coast.items() if k != "scale"}
+        paths = coast_paths(clon=clon, clat=clat, extent=tuple(extent), scale=coast["scale"])
+        ax.add_collection(
+            PathCollection(paths, transform=ax.transData, zorder=0, **style), autolim=False
+        )
+    if toponyms:
+        text_kw = dict(ha="center", va="center", fontsize="small", style="italic")
+        if isinstance(toponyms, dict):
+            text_kw.update(toponyms)
+        for (x, y), item in zip(toponym_positions(clon, clat), TOPONYMS):
+            ax.text(x, y, item["name"], transform=ax.transData, **text_kw)
+    return ax
+
+
+def lcc_axes(fig, *args, clon=clon, clat=clat, **kwargs):
+    """
+    Add an LCC `GeoAxes` with a cached background to `fig`.
+
+    `args` are passed to `fig.add_subplot()`, `kwargs` to `add_background()`.
+    """
+    ax = fig.add_subplot(*args, projection=lcc_projection(clon, clat))
+    return add_background(ax, clon=clon, clat=clat, **kwargs)
+
+
+def lcc_axes_grid(fig, nrows, ncols, clon=clon, clat=clat, **kwargs):
+    """Make a (nrows, ncols) array of LCC `GeoAxes` with cached backgrounds."""
+    axs = fig.subplots(
+        nrows, ncols, squeeze=False, subplot_kw=dict(projection=lcc_projection(clon, clat))
+    )
+    for ax in axs.flat:
+        add_background(ax, clon=clon, clat=clat, **kwargs)
+    return axs
+
+
+def render_parallel(plot_func, items, nproc=1, **bg_kw):
+    """
+    Call `plot_func` on each of `items` in worker processes.
+
+    `plot_func` should be a module-level function that makes a figure for one
+    item and saves it to a file. The background used by the workers is built
+    before they are started, so that all of them read it from the disk cache.
+
+    Parameters
+    ----------
+    plot_func: callable
+        Function of one argument returning e.g. the path to the saved figure
+    items: iterable
+        Arguments to `plot_func`
+    nproc: int, optional
+        Number of worker processes; 1 to run in the current process
+    bg_kw: dict, optional
+        Projection centre, extent and coast scale of the background, passed to `coast_paths()`
+
+    Returns
+    -------
+    list
+        Results of `plot_func`, in the order of `items`
+    """
+    if "extent" in bg_kw:
+        bg_kw["extent"] = tuple(bg_kw["extent"])
+    coast_paths(**bg_kw)
+    if nproc == 1:
+        return [plot_func(item) for item in items]
+    with ProcessPoolExecutor(max_workers=nproc) as executor:
+        return list(executor.map(plot_func, items))
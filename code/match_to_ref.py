@@ -1,16 +1,17 @@
 # coding: utf-8
 """Match cyclone tracks from ERA5 and ERA-Interim to a reference list of polar lows."""
+import argparse
 import json
 from loguru import logger as L
 from pathlib import Path
 
-import octant
-from octant.core import TrackRun
-from octant.decor import get_pbar
-
+from archive_cache import HDF_LOCK, archive_path, load_trackrun
 from common_defs import CAT, bbox, datasets, period, winters
 import mypaths
 from obs_tracks_api import read_all_accacia, read_all_stars, prepare_tracks
+from prefetch import prefetch
+from shards import add_shard_arg, matches_path, select_shard
+from time_index import build_time_index, load_time_index, time_window
 
 
 NAME = "stars"
@@ -75,22 +76,134 @@ def _make_match_label(match_kwargs, delim="_"):
     return delim.join(match_kwargs_label)
 
 
+def load_ref_tracks(name=NAME):
+    """Load reference tracks and select those that satisfy the filter functions."""
+    return prepare_tracks(
+        REF_DATASETS[name]["load_func"](), filter_funcs=REF_DATASETS[name]["filter_func"]
+    )
+
+
+def match_run(TR, obs_tracks, match_kwargs, time_dict, pbar=iter, time_index=None):
+    """
+    Match `CAT` tracks of a `TrackRun` to reference tracks winter by winter.
+
+    Tracks of each winter are selected using the time index of `TR`, which is built
+    if `time_index` is not given.
+
+    Returns
+    -------
+    match_pairs_abs: list
+        List of (track index, reference track number) tuples
+    """
+    if time_index is None:
+        time_index = build_time_index(TR.data)
+    match_pairs_abs = []
+    for winter, w_dates in pbar(time_dict.items()):
+        tr = time_window(TR, *w_dates, index=time_index, clip=True)
+        L.debug(tr)
+        L.debug(match_kwargs)
+        L.debug(winter)
+        match_pairs = tr.match_tracks(obs_tracks, subset=CAT, **match_kwargs)
+        for match_pair in match_pairs:
+            match_pairs_abs.append((match_pair[0], obs_tracks[match_pair[1]].N.unique()[0]))
+    return match_pairs_abs
+
+
+def write_matches(path, match_pairs_abs, dset, run_id, match_kwargs_label):
+    """Save matching pairs to a text file."""
+    with path.open("w") as fout:
+        fout.write(
+            f"""# {dset}
+# {run_id:03d}
+# {period}
+# {match_kwargs_label}
+"""
+        )
+        for match_pair in match_pairs_abs:
+            fout.write("{:d},{:d}\n".format(*match_pair))
+
+
+def parse_args(args=None):
+    """Parse command line arguments."""
+    ap = argparse.ArgumentParser(
+        Path(__file__).name,
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    ap.add_argument(
+        "--prefetch",
+        type=int,
+        default=1,
+        help="Number of archives to read in advance in background threads (0 to disable)",
+    )
+    add_shard_arg(ap)
+    return ap.parse_args(args)
+
+
+def _load_archive(item):
+    """Load a `TrackRun` archive and its time index in the same (background) thread."""
+    dset, run_id = item[:2]
+    path = archive_path(dset, run_id)
+    TR = load_trackrun(path)
+    with HDF_LOCK:
+        t_index = load_time_index(path)
+    return TR, t_index
+
+
+def main_shard(shard, obs_tracks, pbar=iter, n_ahead=1):
+    """Match a part of (dataset, run, match option, winter) combinations."""
+    work = []
+    for dset in datasets:
+        with RUN_GROUPS[RUN_GROUP]["paths"][dset].open("r") as fp:
+            runs_grid = json.load(fp)
+        for run_id, _ in enumerate(runs_grid, RUN_GROUPS[RUN_GROUP]["start"]):
+            for match_kwargs in match_options:
+                for winter in REF_DATASETS[NAME]["time_dict"]:
+                    work.append((dset, run_id, match_kwargs, winter))
+    # Combinations of this shard grouped by archive, so that each archive is loaded once
+    by_archive = {}
+    for dset, run_id, match_kwargs, winter in select_shard(work, shard):
+        by_archive.setdefault((dset, run_id), []).append((match_kwargs, winter))
+
+    for (dset, run_id), (TR, t_index) in pbar(
+        prefetch(_load_archive, by_archive, n_ahead=n_ahead)
+    ):
+        for match_kwargs, winter in by_archive[(dset, run_id)]:
+            match_pairs_abs = match_run(
+                TR,
+                obs_tracks,
+                match_kwargs,
+                {winter: REF_DATASETS[NAME]["time_dict"][winter]},
+                time_index=t_index,
+            )
+            match_kwargs_label = _make_match_label(match_kwargs)
+            path = matches_path(dset, run_id, NAME, match_kwargs_label, winter)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            write_matches(path, match_pairs_abs, dset, run_id, match_kwargs_label)
+
+
 @L.catch
-def main():
+def main(args=None):
+    args = parse_args(args)
     LOGPATH = Path(__file__).parent / "logs"
     LOGPATH.mkdir(exist_ok=True)
     # L.remove(0)
     L.add(LOGPATH / f"log_match_to_{NAME}_{{time}}.log")
+    import octant
+    from octant.decor import get_pbar
+
     octant.RUNTIME.enable_progress_bar = True
     pbar = get_pbar(use="tqdm")
     octant.RUNTIME.enable_progress_bar = False
 
-    obs_tracks = prepare_tracks(
-        REF_DATASETS[NAME]["load_func"](), filter_funcs=REF_DATASETS[NAME]["filter_func"]
-    )
+    obs_tracks = load_ref_tracks(NAME)
     n_ref = len(obs_tracks)
     L.debug(f"Number of suitable tracks: {n_ref}")
 
+    if args.shard is not None:
+        main_shard(args.shard, obs_tracks, pbar=pbar, n_ahead=args.prefetch)
+        return
+
     # Define an output directory and create it if it doesn't exist
     output_dir = mypaths.procdir / "matches"
     output_dir.mkdir(exist_ok=True)
@@ -99,37 +212,29 @@ def main():
     for dset in pbar(datasets[:]):  # , desc="dataset"):
         with RUN_GROUPS[RUN_GROUP]["paths"][dset].open("r") as fp:
             runs_grid = json.load(fp)
-        for run_id, _ in pbar(enumerate(runs_grid, RUN_GROUPS[RUN_GROUP]["start"])):
-            TR = TrackRun.from_archive(mypaths.procdir / f"{dset}_run{run_id:03d}_{period}.h5")
-            L.debug(mypaths.procdir / f"{dset}_run{run_id:03d}_{period}.h5")
+        run_ids = [run_id for run_id, _ in enumerate(runs_grid, RUN_GROUPS[RUN_GROUP]["start"])]
+        work = [(dset, run_id) for run_id in run_ids]
+        # The next run's archive is read while the current run is matched
+        for (_, run_id), (TR, t_index) in pbar(
+            prefetch(_load_archive, work, n_ahead=args.prefetch)
+        ):
+            L.debug(archive_path(dset, run_id))
             L.debug(TR)
             for match_kwargs in pbar(match_options):  # , desc="match options"):
-                match_pairs_abs = []
-                for winter, w_dates in pbar(REF_DATASETS[NAME]["time_dict"].items()):
-                    tr = TR.time_slice(*w_dates)
-                    L.debug(tr)
-                    L.debug(run_id)
-                    L.debug(match_kwargs)
-                    L.debug(winter)
-                    match_pairs = tr.match_tracks(obs_tracks, subset=CAT, **match_kwargs)
-                    for match_pair in match_pairs:
-                        match_pairs_abs.append(
-                            (match_pair[0], obs_tracks[match_pair[1]].N.unique()[0])
-                        )
+                L.debug(run_id)
+                match_pairs_abs = match_run(
+                    TR,
+                    obs_tracks,
+                    match_kwargs,
+                    REF_DATASETS[NAME]["time_dict"],
+                    pbar=pbar,
+                    time_index=t_index,
+                )
                 match_kwargs_label = _make_match_label(match_kwargs)
 
                 # Save matching pairs to a text file
                 fname = f"{dset}_run{run_id:03d}_{period}_{NAME}_{match_kwargs_label}.txt"
-                with (output_dir / fname).open("w") as fout:
-                    fout.write(
-                        f"""# {dset}
-# {run_id:03d}
-# {period}
-# {match_kwargs_label}
-"""
-                    )
-                    for match_pair in match_pairs_abs:
-                        fout.write("{:d},{:d}\n".format(*match_pair))
+                write_matches(output_dir / fname, match_pairs_abs, dset, run_id, match_kwargs_label)
 
 
 if __name__ == "__main__":
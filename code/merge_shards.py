@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Assemble final archives, match files and tables from partial outputs of shards."""
+import argparse
+import json
+from pathlib import Path
+import sys
+from textwrap import dedent
+
+from loguru import logger as L
+
+import pandas as pd
+
+from categorise_and_save import parse_runs
+from common_defs import datasets, period, winters
+from extract_matches import read_matches
+from match_to_ref import NAME, REF_DATASETS, RUN_GROUP, RUN_GROUPS, _make_match_label
+from match_to_ref import match_options, write_matches
+import mypaths
+from shards import categorised_path, find_partials, matches_path
+from time_index import build_time_index, save_time_index
+
+SCRIPT = Path(__file__).name
+
+
+def parse_args(args=None):
+    """Parse command line arguments."""
+    epilog = dedent(
+        f"""Example of use:
+    ./{SCRIPT} categorise -n era5 --runs 0-10
+    ./{SCRIPT} match
+    ./{SCRIPT} table /path/to/scores_vort_thresh_era5_2000_2018_stars.csv
+    """
+    )
+    ap = argparse.ArgumentParser(
+        SCRIPT,
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog=epilog,
+    )
+    subparsers = ap.add_subparsers(dest="command")
+    subparsers.required = True
+
+    ap_cat = subparsers.add_parser("categorise", help="Merge output of categorise_and_save.py")
+    ap_cat.add_argument(
+        "-n",
+        "--name",
+        type=str,
+        required=True,
+        choices=["era5", "interim"],
+        help="Name of the dataset",
+    )
+    ap_cat.add_argument(
+        "-r",
+        "--runs",
+        type=str,
+        required=True,
+        help="Run numbers, comma- or dash-separated (inclusive range)",
+    )
+    ap_cat.add_argument(
+        "--regions",
+        action="store_true",
+        help="Merge output of categorise_and_save.py --regions",
+    )
+
+    subparsers.add_parser("match", help="Merge output of match_to_ref.py")
+
+    ap_tab = subparsers.add_parser(
+        "table", help="Merge output of sweep.py (.csv) or extract_matches.py (.h5)"
+    )
+    ap_tab.add_argument("path", type=str, help="Path to the final file")
+    return ap.parse_args(args)
+
+
+def _check_exist(paths):
+    missing = [str(path) for path in paths if not path.exists()]
+    if missing:
+        raise FileNotFoundError("Missing partial output:\n" + "\n".join(missing))
+
+
+def merge_categorised(dset, run_ids, suffix=""):
+    """Concatenate categorised winters of each run and save them to one archive."""
+    from octant.core import TrackRun
+
+    for run_id in run_ids:
+        paths = [categorised_path(dset, run_id, winter, suffix=suffix) for winter in winters]
+        _check_exist(paths)
+        full_tr = TrackRun()
+        for path in paths:
+            full_tr += TrackRun.from_archive(path)
+        out_path = mypaths.procdir / f"{dset}_run{run_id:03d}_{period}{suffix}.h5"
+        full_tr.to_archive(out_path)
+        save_time_index(out_path, build_time_index(full_tr.data))
+        L.info(f"Saved to {out_path}")
+
+
+def merge_matches(ref_name=NAME, run_group=RUN_GROUP):
+    """Concatenate matching pairs of all winters of each run and matching option."""
+    output_dir = mypaths.procdir / "matches"
+    output_dir.mkdir(exist_ok=True)
+    for dset in datasets:
+        with RUN_GROUPS[run_group]["paths"][dset].open("r") as fp:
+            runs_grid = json.load(fp)
+        for run_id, _ in enumerate(runs_grid, RUN_GROUPS[run_group]["start"]):
+            for match_kwargs in match_options:
+                label = _make_match_label(match_kwargs)
+                paths = [
+                    matches_path(dset, run_id, ref_name, label, winter)
+                    for winter in REF_DATASETS[ref_name]["time_dict"]
+                ]
+                _check_exist(paths)
+                pairs = pd.concat([read_matches(path) for path in paths]).values
+                fname = f"{dset}_run{run_id:03d}_{period}_{ref_name}_{label}.txt"
+                write_matches(output_dir / fname, pairs, dset, run_id, label)
+
+
+def merge_table(path):
+    """Combine partial .csv tables or .h5 archives into one file."""
+    path = Path(path)
+    partials = find_partials(path)
+    if not partials:
+        raise FileNotFoundError(f"No partial output found for {path}")
+    L.info(f"Merging {len(partials)} files into {path}")
+    if path.suffix == ".csv":
+        pd.concat([pd.read_csv(i) for i in partials]).to_csv(path, index=False)
+    elif path.suffix == ".h5":
+        with pd.HDFStore(path, mode="w") as store:
+            for partial in partials:
+                with pd.HDFStore(partial, mode="r") as part:
+                    for key in part.keys():
+                        store.put(key, part[key])
+                        store.get_storer(key).attrs.metadata = part.get_storer(
+                            key
+                        ).attrs.metadata
+    else:
+        raise ValueError(f"Unknown file type: {path.suffix}")
+
+
+def main(args=None):
+    """Merge partial outputs."""
+    args = parse_args(args)
+    if args.command == "categorise":
+        merge_categorised(
+            args.name, parse_runs(args.runs), suffix="_regions" if args.regions else ""
+        )
+    elif args.command == "match":
+        merge_matches()
+    elif args.command == "table":
+        merge_table(args.path)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
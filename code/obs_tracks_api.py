@@ -1,7 +1,5 @@
 # -*- coding: utf-8 -*-
 """Functions for loading STARS and ACCACIA datasets of PMCs."""
-from octant.core import OctantTrack
-
 import pandas as pd
 
 import mypaths
@@ -55,6 +53,7 @@ def read_all_accacia():
 
 def prepare_tracks(obs_df, filter_funcs=[]):
     """Make a list of those tracks that satisfy the list of conditions."""
+    from octant.core import OctantTrack
 
     selected = []
     for i, df in obs_df.groupby("N"):
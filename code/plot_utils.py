@@ -5,7 +5,6 @@ Various plotting functions and useful parameters
 from itertools import cycle
 import string
 
-import cartopy.crs as ccrs
 import matplotlib as mpl
 
 import matplotlib.pyplot as plt
@@ -24,21 +23,27 @@ AXGR_KW = dict(
 )
 
 # Common cartopy settings
-trans = dict(transform=ccrs.PlateCarree())
 COAST = dict(scale="50m", alpha=0.5, edgecolor="#333333", facecolor="#AAAAAA")
 clon = 15
 clat = 75
 extent = [-20, 50, 65, 85]
 LCC_KW = dict(clon=clon, clat=clat, coast=COAST, extent=extent, ticks=None)
 
-mapkey = dict(transform=ccrs.PlateCarree())
-
 clev101 = list(np.linspace(-1, 1, 9))
 clev101.remove(0)
 clev101 = np.array(clev101)
 
-# Density map plot settings
-abs_plt_kw = dict(cmap="Oranges", extend="max", **trans)
+
+def __getattr__(name):
+    """Create settings that need cartopy on first access, so that it is imported only then."""
+    if name in ("trans", "mapkey"):
+        import cartopy.crs as ccrs
+
+        return dict(transform=ccrs.PlateCarree())
+    elif name == "abs_plt_kw":
+        # Density map plot settings
+        return dict(cmap="Oranges", extend="max", **__getattr__("trans"))
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def div_cmap(
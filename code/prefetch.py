@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Overlap loading of data with computation using a background thread pool."""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def prefetch(func, items, n_ahead=2, max_workers=None):
+    """
+    Apply `func` to `items` in background threads, yielding results in order.
+
+    While the caller processes the result for one item, up to `n_ahead` next
+    items are loaded. The number of results held in memory is therefore
+    bounded by `n_ahead` + 1.
+
+    Parameters
+    ----------
+    func: callable
+        Function of one argument, e.g. reading a file
+    items: iterable
+        Arguments to `func`
+    n_ahead: int, optional
+        Number of items to load in advance. If 0, items are loaded sequentially
+        in the calling thread.
+    max_workers: int, optional
+        Number of threads, `n_ahead` by default
+
+    Yields
+    ------
+    item: object
+        Element of `items`
+    result: object
+        Result of `func(item)`
+    """
+    if n_ahead <= 0:
+        for item in items:
+            yield item, func(item)
+        return
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers or n_ahead) as executor:
+        queue = deque()
+        for item in items:
+            queue.append((item, executor.submit(func, item)))
+            if len(queue) >= n_ahead:
+                break
+        while queue:
+            item, future = queue.popleft()
+            result = future.result()
+            # Submit the next item before handing over the current result
+            for next_item in items:
+                queue.append((next_item, executor.submit(func, next_item)))
+                break
+            yield item, result
@@ -1,8 +1,5 @@
 # -*- coding: utf-8 -*-
 """Functions to load satellite data."""
-import cartopy.crs as ccrs
-import rasterio
-
 import mypaths
 
 
@@ -28,6 +25,9 @@ def read_raster_stereo(filename=mypaths.avhrr_file):
     crs: cartopy.crs.Projection
         Stereographic projection of the image
     """
+    import cartopy.crs as ccrs
+    import rasterio
+
     with rasterio.open(filename, "r") as src:
         proj = src.crs.to_dict()
         crs = ccrs.Stereographic(
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Verification scores of all runs with winter-block bootstrap confidence intervals.
+
+Matching results are converted once to hit/miss flags of each reference track
+and each categorised track, and then to counts per winter, stacked for all runs
+and matching options into arrays of shape (run, winter). Bootstrap samples
+resample whole winters with replacement. The same random samples are used for
+all runs, so that each one is a matrix product of the counts and the number of
+times each winter is drawn in each sample.
+"""
+import argparse
+import json
+from pathlib import Path
+import sys
+from textwrap import dedent
+
+from loguru import logger as L
+
+import numpy as np
+
+import pandas as pd
+
+from archive_cache import archive_path, load_trackrun
+from common_defs import CAT, datasets, period
+from extract_matches import read_matches
+from match_to_ref import NAME, REF_DATASETS, RUN_GROUPS, _make_match_label, load_ref_tracks
+from match_to_ref import match_options
+import mypaths
+from time_index import build_time_index, window_rows
+from track_io import MUX_NAMES
+
+SCRIPT = Path(__file__).name
+COUNTS = ["n_ref", "n_hit_ref", "n_cat", "n_hit_cat"]
+
+
+def parse_args(args=None):
+    """Parse command line arguments."""
+    epilog = dedent(
+        f"""Example of use:
+    ./{SCRIPT} -g vort_thresh --n-boot 10000
+    """
+    )
+    ap = argparse.ArgumentParser(
+        SCRIPT,
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog=epilog,
+    )
+    ap.add_argument(
+        "-g", "--group", type=str, default="vort_thresh", choices=[*RUN_GROUPS], help="Run group"
+    )
+    ap.add_argument(
+        "--ref", type=str, default=NAME, choices=[*REF_DATASETS], help="Reference dataset"
+    )
+    ap.add_argument("--n-boot", type=int, default=1000, help="Number of bootstrap samples")
+    ap.add_argument("--alpha", type=float, default=0.05, help="1 - confidence level")
+    ap.add_argument("--seed", type=int, default=0, help="Random seed")
+    return ap.parse_args(args)
+
+
+def track_winters(data, time_dict, index=None):
+    """
+    Find the winter of each track using the same windows as `match_to_ref.match_run()`.
+
+    Parameters
+    ----------
+    data: pandas.DataFrame
+        Track table with a (track_idx, row_idx) index and a time column
+    time_dict: dict
+        Winter names and (start, end) dates
+    index: pandas.DataFrame, optional
+        Time index of `data`, built if not given
+
+    Returns
+    -------
+    track_ids: numpy.ndarray
+        Track indices
+    winter: numpy.ndarray
+        Index of the winter in `time_dict` whose window contains at least one point
+        of each track, -1 if none
+    """
+    if index is None:
+        index = build_time_index(data)
+    track_ids = index.index.values
+    winter = np.full(track_ids.shape, -1)
+    for i, w_dates in enumerate(time_dict.values()):
+        rows = window_rows(data, *w_dates, index=index, clip=True)
+        winter[np.isin(track_ids, rows.index.get_level_values(0).values)] = i
+    return track_ids, winter
+
+
+def ref_track_winters(obs_tracks, time_dict):
+    """Numbers of reference tracks and the index of the winter of each track."""
+    data = pd.DataFrame(
+        {"time": np.concatenate([ot.time.values for ot in obs_tracks]).astype("datetime64[ns]")},
+        index=pd.MultiIndex.from_arrays(
+            [
+                np.concatenate([ot.N.values for ot in obs_tracks]),
+                np.concatenate([np.arange(ot.shape[0]) for ot in obs_tracks]),
+            ],
+            names=MUX_NAMES,
+        ),
+    )
+    return track_winters(data, time_dict)
+
+
+def winter_counts(hit_ref, ref_winter, hit_cat, cat_winter, n_winters):
+    """
+    Count reference and categorised tracks and their hits by winter.
+
+    Parameters
+    ----------
+    hit_ref, hit_cat: numpy.ndarray
+        Boolean flags of matched reference and categorised tracks
+    ref_winter, cat_winter: numpy.ndarray
+        Winter index of each track (-1 for tracks outside of all winters)
+    n_winters: int
+        Number of winters
+
+    Returns
+    -------
+    dict
+        Arrays of size `n_winters` for each of `COUNTS`
+    """
+
+    def _count(winter, weights=None):
+        ok = winter >= 0
+        weights = None if weights is None else weights[ok]
+        return np.bincount(winter[ok], weights=weights, minlength=n_winters)
+
+    return dict(
+        n_ref=_count(ref_winter),
+        n_hit_ref=_count(ref_winter, hit_ref.astype(float)),
+        n_cat=_count(cat_winter),
+        n_hit_cat=_count(cat_winter, hit_cat.astype(float)),
+    )
+
+
+def match_counts(matched_cat, matched_ref, ref_ids, ref_winter, cat_ids, cat_winter, n_winters):
+    """
+    Count reference and categorised tracks and their hits by winter from matching pairs.
+
+    Parameters
+    ----------
+    matched_cat, matched_ref: array-like
+        Track indices and reference track numbers of matching pairs
+    ref_ids, cat_ids: numpy.ndarray
+        Numbers of all reference tracks and indices of all categorised tracks
+    ref_winter, cat_winter: numpy.ndarray
+        Winter index of each track (-1 for tracks outside of all winters)
+    n_winters: int
+        Number of winters
+
+    Returns
+    -------
+    dict
+        Arrays of size `n_winters` for each of `COUNTS`
+    """
+    hit_ref = np.isin(ref_ids, np.asarray(matched_ref))
+    hit_cat = np.isin(cat_ids, np.asarray(matched_cat))
+    return winter_counts(hit_ref, ref_winter, hit_cat, cat_winter, n_winters)
+
+
+def run_counts(dset, run_id, ref_name, ref_ids, ref_winter, time_dict, options=match_options):
+    """
+    Convert matching results of one run to counts by winter for each matching option.
+
+    Returns
+    -------
+    list
+        List of (match label, counts) pairs
+    """
+    tr = load_trackrun(archive_path(dset, run_id), subset=CAT, columns=["time", "cat"])
+    cat_ids, cat_winter = track_winters(tr.data, time_dict)
+    out = []
+    for match_kwargs in options:
+        label = _make_match_label(match_kwargs)
+        fname = f"{dset}_run{run_id:03d}_{period}_{ref_name}_{label}.txt"
+        pairs = read_matches(mypaths.procdir / "matches" / fname)
+        counts = match_counts(
+            pairs["track_idx"].values,
+            pairs["ref_idx"].values,
+            ref_ids,
+            ref_winter,
+            cat_ids,
+            cat_winter,
+            len(time_dict),
+        )
+        out.append((label, counts))
+    return out
+
+
+def collect_counts(run_group, ref_name=NAME, options=match_options):
+    """
+    Count hits and tracks by winter for all runs of a group and all matching options.
+
+    Returns
+    -------
+    keys: pandas.DataFrame
+        Dataset, run number and matching option of each row of the arrays
+    counts: dict
+        Arrays of shape (row, winter) for each of `COUNTS`
+    """
+    time_dict = REF_DATASETS[ref_name]["time_dict"]
+    ref_ids, ref_winter = ref_track_winters(load_ref_tracks(ref_name), time_dict)
+    keys = []
+    rows = {key: [] for key in COUNTS}
+    for dset in datasets:
+        try:
+            with RUN_GROUPS[run_group]["paths"][dset].open("r") as fp:
+                runs_grid = json.load(fp)
+        except KeyError:
+            continue
+        for run_id, _ in enumerate(runs_grid, RUN_GROUPS[run_group]["start"]):
+            L.debug(f"{dset} run{run_id:03d}")
+            for label, counts in run_counts(dset, run_id, ref_name, ref_ids, ref_winter, time_dict):
+                keys.append(dict(dataset=dset, run_id=run_id, match=label))
+                for key in COUNTS:
+                    rows[key].append(counts[key])
+    return pd.DataFrame(keys), {key: np.array(val) for key, val in rows.items()}
+
+
+def scores_from_counts(n_ref, n_hit_ref, n_cat, n_hit_cat):
+    """Detection rate and false alarm ratio from counts summed over the last axis."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        detection_rate = n_hit_ref.sum(axis=-1) / n_ref.sum(axis=-1)
+        false_alarm_ratio = 1 - n_hit_cat.sum(axis=-1) / n_cat.sum(axis=-1)
+    return detection_rate, false_alarm_ratio
+
+
+def block_bootstrap(counts, n_boot=1000, alpha=0.05, seed=0):
+    """
+    Winter-block bootstrap confidence intervals of detection rate and false alarm ratio.
+
+    Parameters
+    ----------
+    counts: dict
+        Arrays of shape (row, winter) for each of `COUNTS`
+    n_boot: int, optional
+        Number of bootstrap samples
+    alpha: float, optional
+        The intervals are between the alpha/2 and 1 - alpha/2 quantiles
+    seed: int, optional
+        Random seed
+
+    Returns
+    -------
+    pandas.DataFrame
+        Point estimates and confidence intervals of each row
+    """
+    n_winters = counts["n_ref"].shape[-1]
+    rng = np.random.RandomState(seed)
+    # One matrix of resampled winters shared by all rows
+    idx = rng.randint(0, n_winters, size=(n_boot, n_winters))
+    # Number of times each winter is drawn in each sample, (n_boot, n_winters)
+    weights = np.zeros((n_boot, n_winters))
+    np.add.at(weights, (np.arange(n_boot)[:, np.newaxis], idx), 1)
+    # Resampled totals of shape (row, n_boot, 1), so that they can be summed over the last axis
+    resampled = {key: (arr @ weights.T)[..., np.newaxis] for key, arr in counts.items()}
+
+    out = {}
+    q = [alpha / 2, 1 - alpha / 2]
+    point = scores_from_counts(**counts)
+    boot = scores_from_counts(**resampled)
+    for name, est, samples in zip(["detection_rate", "false_alarm_ratio"], point, boot):
+        out[name] = est
+        out[f"{name}_lower"], out[f"{name}_upper"] = np.nanquantile(samples, q, axis=1)
+    for key, arr in counts.items():
+        out[key] = arr.sum(axis=-1).astype(int)
+    return pd.DataFrame(out)
+
+
+def main(args=None):
+    """Calculate verification scores of a run group and save them to a .csv file."""
+    args = parse_args(args)
+    keys, counts = collect_counts(args.group, ref_name=args.ref)
+    table = pd.concat(
+        [keys, block_bootstrap(counts, n_boot=args.n_boot, alpha=args.alpha, seed=args.seed)],
+        axis=1,
+    )
+    out_path = mypaths.procdir / f"scores_ci_{args.group}_{period}_{args.ref}.csv"
+    table.to_csv(out_path, index=False)
+    L.info(f"Saved to {out_path}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Sea-ice concentration at genesis points of tracks.
+
+The daily sea-ice concentration is converted once from the netCDF file
+downloaded by download_seaice.py to a (day, latitude, longitude) `.npy` cube,
+which is then memory-mapped. Values at genesis points of all tracks in a table
+are looked up by a single fancy-indexing gather, so only the pages of the cube
+that are actually needed are read from disk. The cube covers `DOMAIN`, the union
+of the study area and all named regions, which is also the area downloaded by
+download_seaice.py. The cube is built once and never rewritten while in use;
+a cube that does not cover the requested area is an error.
+"""
+from loguru import logger
+
+import numpy as np
+
+from common_defs import bbox, regions
+import mypaths
+from track_io import save_npy
+
+
+SEAICE_FILE = "{dset}.an.sfc.2000-2018.sea_ice_cover.nc"
+CACHE_DIR = mypaths.procdir / "seaice"
+# Arrays saved in the cache directory; data is written last
+CUBE_FILES = ["lon", "lat", "days", "data"]
+# Datasets with sea-ice concentration downloaded by download_seaice.py
+SEAICE_DATASETS = ["era5"]
+# Union of the study area and named regions (lon0, lon1, lat0, lat1)
+DOMAIN = [
+    min(i[0] for i in [bbox, *regions.values()]),
+    max(i[1] for i in [bbox, *regions.values()]),
+    min(i[2] for i in [bbox, *regions.values()]),
+    max(i[3] for i in [bbox, *regions.values()]),
+]
+
+
+def download_area(box=DOMAIN):
+    """Area of a lon-lat box (lon0, lon1, lat0, lat1) in the North/West/South/East format of CDS."""
+    return f"{box[3]}/{box[0]}/{box[2]}/{box[1]}"
+
+
+def seaice_path(dset):
+    """Path to the sea-ice concentration file of a dataset downloaded by download_seaice.py."""
+    if dset not in SEAICE_DATASETS:
+        raise ValueError(f"No sea-ice data for {dset}; available: {SEAICE_DATASETS}")
+    return mypaths.ra_dir / dset / SEAICE_FILE.format(dset=dset)
+
+
+def grid_covers_box(lon, lat, box):
+    """Check if a regular lon-lat grid covers `box` (lon0, lon1, lat0, lat1) to within a cell."""
+    if lon.shape[0] < 2 or lat.shape[0] < 2:
+        return False
+    dx, dy = np.abs(np.diff(lon)).max(), np.abs(np.diff(lat)).max()
+    return (
+        lon.min() <= box[0] + dx
+        and lon.max() >= box[1] - dx
+        and lat.min() <= box[2] + dy
+        and lat.max() >= box[3] - dy
+    )
+
+
+def build_cube(dset, box=DOMAIN, cache_dir=CACHE_DIR):
+    """
+    Convert sea-ice concentration to a daily cube of float32 values saved in `.npy` files.
+
+    Longitudes are shifted to the (-180, 180) range and the data are cropped to `box`.
+    Each file is written to a temporary file and moved into place, the data last,
+    so that a partially built cube is never read.
+
+    Raises
+    ------
+    ValueError
+        If the downloaded data do not cover `box`
+    """
+    import xarray as xr
+
+    src = seaice_path(dset)
+    logger.info(f"Building sea-ice cube from {src}")
+    da = xr.open_dataarray(src)
+    da = da.assign_coords(longitude=(((da.longitude + 180) % 360) - 180)).sortby("longitude")
+    da = da.sel(
+        longitude=(da.longitude >= box[0]) & (da.longitude <= box[1]),
+        latitude=(da.latitude >= box[2]) & (da.latitude <= box[3]),
+    )
+    if not grid_covers_box(da.longitude.values, da.latitude.values, box):
+        raise ValueError(
+            f"{src} does not cover {box}; download it again with download_seaice.py"
+        )
+    da = da.resample(time="1D").mean().transpose("time", "latitude", "longitude")
+
+    out_dir = cache_dir / dset
+    out_dir.mkdir(parents=True, exist_ok=True)
+    arrays = {
+        "lon": da.longitude.values.astype(float),
+        "lat": da.latitude.values.astype(float),
+        "days": da.time.values.astype("datetime64[D]"),
+        "data": da.values.astype(np.float32),
+    }
+    for key in CUBE_FILES:
+        save_npy(out_dir / f"{key}.npy", arrays[key])
+    return out_dir
+
+
+class SeaIceCube:
+    """Memory-mapped daily sea-ice concentration on a regular grid."""
+
+    def __init__(self, dset, box=DOMAIN, cache_dir=CACHE_DIR, mmap_mode="r"):
+        """
+        Load the cube from `cache_dir`, building it first if it does not exist.
+
+        Parameters
+        ----------
+        dset: str
+            Name of the reanalysis, one of `SEAICE_DATASETS`
+        box: list, optional
+            Lon-lat box that the cube has to cover
+        cache_dir: pathlib.Path, optional
+            Directory with cubes of each dataset
+        mmap_mode: str, optional
+            Passed to `numpy.load()`
+
+        Raises
+        ------
+        ValueError
+            If there is no sea-ice data for `dset` or the saved cube does not cover `box`
+        """
+        if dset not in SEAICE_DATASETS:
+            raise ValueError(f"No sea-ice data for {dset}; available: {SEAICE_DATASETS}")
+        cube_dir = cache_dir / dset
+        if not all((cube_dir / f"{key}.npy").exists() for key in CUBE_FILES):
+            build_cube(dset, box=box, cache_dir=cache_dir)
+        self._read(cube_dir, mmap_mode)
+        if not self.covers_box(box):
+            # Other processes may have memory-mapped the cube, so it is not rebuilt here
+            raise ValueError(
+                f"Sea-ice cube in {cube_dir} does not cover {box}; remove it to rebuild"
+            )
+
+    def _read(self, cube_dir, mmap_mode):
+        self.data = np.load(cube_dir / "data.npy", mmap_mode=mmap_mode)
+        self.days = np.load(cube_dir / "days.npy")
+        self.lon = np.load(cube_dir / "lon.npy")
+        self.lat = np.load(cube_dir / "lat.npy")
+
+    def covers_box(self, box):
+        """Check if the cube covers a lon-lat box."""
+        return grid_covers_box(self.lon, self.lat, box)
+
+    def _grid_index(self, coord, x):
+        idx = np.rint((x - coord[0]) / (coord[1] - coord[0])).astype(int)
+        return idx, (idx >= 0) & (idx < coord.shape[0])
+
+    def _indices(self, times, lon, lat):
+        days = times.astype("datetime64[D]")
+        it = np.minimum(np.searchsorted(self.days, days), self.days.shape[0] - 1)
+        ok_t = self.days[it] == days
+        ix, ok_x = self._grid_index(self.lon, lon)
+        iy, ok_y = self._grid_index(self.lat, lat)
+        return it, iy, ix, ok_t & ok_x & ok_y
+
+    def inside(self, times, lon, lat):
+        """Check if points are within the grid and the time period of the cube."""
+        return self._indices(times, lon, lat)[-1]
+
+    def lookup(self, times, lon, lat):
+        """
+        Sea-ice concentration at the nearest grid point on the same day.
+
+        Parameters
+        ----------
+        times: numpy.ndarray
+            Array of datetime64 values
+        lon, lat: numpy.ndarray
+            Coordinates of points
+
+        Returns
+        -------
+        numpy.ndarray
+            Sea-ice concentration, NaN over land or outside the cube
+        """
+        it, iy, ix, ok = self._indices(times, lon, lat)
+        out = np.full(ok.shape, np.nan, dtype=np.float32)
+        out[ok] = self.data[it[ok], iy[ok], ix[ok]]
+        return out
+
+
+class SeaIceGenesis:
+    """
+    Categorisation criterion rejecting tracks that start over sea ice.
+
+    Before classifying a track table, `prepare()` looks up the sea-ice concentration
+    at all genesis points at once. The instance can then be used in the list of
+    conditions of `TrackRun.classify()`, where it only checks set membership.
+    Points over land (NaN) pass, because they are handled by the land mask criterion.
+    Points outside the cube fail, and a warning is issued.
+    """
+
+    def __init__(self, cube, thresh=0.15):
+        """
+        Parameters
+        ----------
+        cube: SeaIceCube
+            Sea-ice concentration
+        thresh: float, optional
+            Maximum sea-ice concentration (0-1) at genesis
+        """
+        self.cube = cube
+        self.thresh = thresh
+        self.allowed = set()
+
+    def prepare(self, data):
+        """Find tracks in a track table that start over open water."""
+        genesis = data.xs(0, level="row_idx")
+        points = (
+            genesis["time"].values.astype("datetime64[ns]"),
+            genesis["lon"].values,
+            genesis["lat"].values,
+        )
+        conc = self.cube.lookup(*points)
+        inside = self.cube.inside(*points)
+        if not inside.all():
+            logger.warning(
+                f"{(~inside).sum()} genesis points are outside the sea-ice cube; tracks rejected"
+            )
+        ok = inside & ~(conc > self.thresh)
+        self.allowed = set(genesis.index.values[ok].tolist())
+        logger.debug(f"Genesis over open water: {ok.sum()}/{ok.shape[0]}")
+
+    def __call__(self, ot):
+        """Check if the track `ot` starts over open water."""
+        return ot.index.get_level_values(0)[0] in self.allowed
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Splitting batch jobs into shards, e.g. for HPC array jobs.
+
+The full work list of a script is built in a deterministic order
+and task k is assigned to shard k mod N. Each shard writes partial outputs
+to `SHARD_DIR`, which are then assembled by `merge_shards.py`.
+"""
+import argparse
+
+import mypaths
+
+
+SHARD_DIR = mypaths.procdir / "shards"
+
+
+def parse_shard(text):
+    """Convert "i/N" to a tuple of integers (i, N), where 0 <= i < N."""
+    try:
+        i, n = [int(j) for j in text.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Wrong format of shard: {text}, should be i/N")
+    if not (n > 0 and 0 <= i < n):
+        raise argparse.ArgumentTypeError(f"Shard index should be in [0, {n}), got {i}")
+    return i, n
+
+
+def add_shard_arg(ap):
+    """Add the --shard option to an `argparse.ArgumentParser` or an argument group."""
+    ap.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="Process only shard i of N (0-based) of the work list and save partial output",
+    )
+
+
+def select_shard(items, shard=None):
+    """Select items of a work list that belong to a shard."""
+    items = list(items)
+    if shard is None:
+        return items
+    i, n = shard
+    return items[i::n]
+
+
+def shard_label(shard):
+    """Label of a shard used in file names."""
+    return f"shard{shard[0]:03d}of{shard[1]:03d}"
+
+
+def categorised_path(dset, run_id, winter, suffix=""):
+    """Path to a categorised winter of a run."""
+    return SHARD_DIR / f"{dset}_run{run_id:03d}_{winter}{suffix}.h5"
+
+
+def matches_path(dset, run_id, ref_name, match_label, winter):
+    """Path to matching pairs within one winter."""
+    return SHARD_DIR / "matches" / f"{dset}_run{run_id:03d}_{winter}_{ref_name}_{match_label}.txt"
+
+
+def partial_path(path, shard):
+    """Path to a part of a file produced by one shard."""
+    return SHARD_DIR / f"{path.stem}.{shard_label(shard)}{path.suffix}"
+
+
+def find_partials(path):
+    """Find all parts of a file produced by different shards."""
+    return sorted(SHARD_DIR.glob(f"{path.stem}.shard*{path.suffix}"))
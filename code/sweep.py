@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Categorise, match and verify all runs of a sensitivity run group in one go."""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+from pathlib import Path
+import sys
+from textwrap import dedent
+
+from loguru import logger as L
+
+import pandas as pd
+
+from categorise_and_save import categorise_winter, lsm_paths, make_conditions, make_masks
+from common_defs import CAT, bbox, period, winters
+from match_to_ref import (
+    REF_DATASETS,
+    RUN_GROUPS,
+    _make_match_label,
+    load_ref_tracks,
+    match_options,
+    match_run,
+    write_matches,
+)
+import mypaths
+from scores import match_counts, ref_track_winters, scores_from_counts, track_winters
+from shards import SHARD_DIR, add_shard_arg, partial_path, select_shard
+from time_index import build_time_index, save_time_index
+
+SCRIPT = Path(__file__).name
+# Objects shared by all tasks of a worker process
+_WORKER = {}
+
+
+def parse_args(args=None):
+    """Parse command line arguments."""
+    epilog = dedent(
+        f"""Example of use:
+    ./{SCRIPT} -n era5 -g vort_thresh -j 8
+    """
+    )
+    ap = argparse.ArgumentParser(
+        SCRIPT,
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog=epilog,
+    )
+    ap.add_argument(
+        "-n",
+        "--name",
+        type=str,
+        required=True,
+        choices=["era5", "interim"],
+        help="Name of the dataset",
+    )
+    ap.add_argument(
+        "-g", "--group", type=str, required=True, choices=[*RUN_GROUPS], help="Run group"
+    )
+    ap.add_argument(
+        "--ref", type=str, default="stars", choices=[*REF_DATASETS], help="Reference dataset"
+    )
+    ap.add_argument("-j", "--nproc", type=int, default=1, help="Number of worker processes")
+    ap.add_argument(
+        "--betterlandmask",
+        action="store_true",
+        help=("Use smoothed ERA5 land mask for both reanalyses"),
+    )
+    ap.add_argument("--cache", action="store_true", help="Read tracks using a columnar cache")
+    ap.add_argument(
+        "--save-archives", action="store_true", help="Save categorised runs to .h5 archives"
+    )
+    ap.add_argument("--save-matches", action="store_true", help="Save matching pairs to text files")
+    add_shard_arg(ap)
+    return ap.parse_args(args)
+
+
+def _init_worker(lsm_path, smooth, ref_name):
+    """Create land masks, categorisation conditions and reference tracks in a worker."""
+    mask, gen_mask = make_masks(lsm_path, bbox, smooth=smooth)
+    _WORKER["conditions"] = make_conditions(mask, gen_mask)
+    _WORKER["obs_tracks"] = load_ref_tracks(ref_name)
+    _WORKER["ref_name"] = ref_name
+    _WORKER["ref_winters"] = ref_track_winters(
+        _WORKER["obs_tracks"], REF_DATASETS[ref_name]["time_dict"]
+    )
+
+
+def process_run(dset, run_id, use_cache=False, save_archive=False, save_matches=False):
+    """
+    Categorise one run, match it to reference tracks and calculate verification scores.
+
+    The track table is kept in memory between the stages. Scores are calculated
+    by the functions of scores.py.
+
+    Returns
+    -------
+    list
+        List of dictionaries with scores, one for each matching option
+    """
+    from octant.core import TrackRun
+
+    conditions = _WORKER["conditions"]
+    obs_tracks = _WORKER["obs_tracks"]
+    ref_name = _WORKER["ref_name"]
+    ref_ids, ref_winter = _WORKER["ref_winters"]
+    time_dict = REF_DATASETS[ref_name]["time_dict"]
+
+    TR = TrackRun()
+    for winter in winters:
+        track_res_dir = mypaths.trackresdir / dset / f"run{run_id:03d}" / winter
+        TR += categorise_winter(track_res_dir, conditions, use_cache=use_cache)
+    L.info(f"{dset} run{run_id:03d}: {TR.size(CAT)} {CAT} tracks")
+    t_index = build_time_index(TR.data)
+    if save_archive:
+        out_path = mypaths.procdir / f"{dset}_run{run_id:03d}_{period}.h5"
+        TR.to_archive(out_path)
+        save_time_index(out_path, t_index)
+
+    cat_ids, cat_winter = track_winters(TR[CAT], time_dict)
+    records = []
+    for match_kwargs in match_options:
+        match_pairs = match_run(TR, obs_tracks, match_kwargs, time_dict, time_index=t_index)
+        match_kwargs_label = _make_match_label(match_kwargs)
+        if save_matches:
+            fname = f"{dset}_run{run_id:03d}_{period}_{ref_name}_{match_kwargs_label}.txt"
+            write_matches(
+                mypaths.procdir / "matches" / fname, match_pairs, dset, run_id, match_kwargs_label
+            )
+        counts = match_counts(
+            [pair[0] for pair in match_pairs],
+            [pair[1] for pair in match_pairs],
+            ref_ids,
+            ref_winter,
+            cat_ids,
+            cat_winter,
+            len(time_dict),
+        )
+        detection_rate, false_alarm_ratio = scores_from_counts(**counts)
+        records.append(
+            dict(
+                dataset=dset,
+                run_id=run_id,
+                match=match_kwargs_label,
+                n_ref=int(counts["n_ref"].sum()),
+                n_cat=int(counts["n_cat"].sum()),
+                n_matches=len(match_pairs),
+                detection_rate=detection_rate,
+                false_alarm_ratio=false_alarm_ratio,
+            )
+        )
+    return records
+
+
+def main(args=None):
+    """Run the sweep over a run group and save the table of scores."""
+    args = parse_args(args)
+    dset = args.name
+    run_group = RUN_GROUPS[args.group]
+    with run_group["paths"][dset].open("r") as fp:
+        runs_grid = json.load(fp)
+    run_ids = [run_id for run_id, _ in enumerate(runs_grid, run_group["start"])]
+    run_ids = select_shard(run_ids, args.shard)
+    L.info(f"{dset}, {args.group}: runs {run_ids}")
+
+    if args.save_matches:
+        (mypaths.procdir / "matches").mkdir(exist_ok=True)
+
+    lsm_path = lsm_paths["era5" if args.betterlandmask else dset]
+    initargs = (lsm_path, args.betterlandmask, args.ref)
+    task_kw = dict(
+        use_cache=args.cache, save_archive=args.save_archives, save_matches=args.save_matches
+    )
+    records = []
+    with ProcessPoolExecutor(
+        max_workers=args.nproc, initializer=_init_worker, initargs=initargs
+    ) as executor:
+        futures = [executor.submit(process_run, dset, run_id, **task_kw) for run_id in run_ids]
+        for future in futures:
+            records.extend(future.result())
+
+    scores = pd.DataFrame.from_records(records)
+    fname = mypaths.procdir / f"scores_{args.group}_{dset}_{period}_{args.ref}.csv"
+    if args.shard is not None:
+        SHARD_DIR.mkdir(parents=True, exist_ok=True)
+        fname = partial_path(fname, args.shard)
+    scores.to_csv(fname, index=False)
+    L.info(f"Saved to {fname}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
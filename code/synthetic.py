@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Generators of synthetic input data mimicking tracker output, land masks and STARS tracks."""
+from pathlib import Path
+
+import numpy as np
+
+import pandas as pd
+
+from common_defs import bbox, columns, winter_dates
+
+
+# Naming and formatting of vortrack text files
+VORTRACK_FNAME = "vortrack_{:04d}_0001.txt"
+TIME_FMT = "%Y%m%d%H%M"
+# Approximate length of 1 degree of latitude [km]
+KM_PER_DEG = 111.2
+
+
+def _random_walk(rng, n, lon0, lat0, tstep_h, speed_ms=(2.0, 15.0)):
+    """Random walk along the sphere starting at (lon0, lat0) with n steps."""
+    speed = rng.uniform(*speed_ms) * 3.6 * tstep_h  # km per time step
+    heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.2, n))
+    dlat = speed * np.cos(heading) / KM_PER_DEG
+    lat = lat0 + np.concatenate([[0], np.cumsum(dlat[:-1])])
+    dlon = speed * np.sin(heading) / (KM_PER_DEG * np.cos(np.deg2rad(lat)))
+    lon = lon0 + np.concatenate([[0], np.cumsum(dlon[:-1])])
+    return lon, lat
+
+
+def make_track(rng, t0, tstep_h=1, max_len=72, box=bbox):
+    """
+    Create a `pandas.DataFrame` with a single synthetic track with `common_defs.columns`.
+
+    Parameters
+    ----------
+    rng: numpy.random.RandomState
+        Random number generator
+    t0: pandas.Timestamp
+        Genesis time
+    tstep_h: int, optional
+        Time step in hours
+    max_len: int, optional
+        Maximum number of time steps
+    box: list, optional
+        Lon-lat bounding box of the genesis points
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    n = rng.randint(2, max_len + 1)
+    lon, lat = _random_walk(
+        rng, n, rng.uniform(box[0], box[1]), rng.uniform(box[2], box[3]), tstep_h
+    )
+    df = pd.DataFrame(
+        {
+            "lon": lon,
+            "lat": lat,
+            "vo": rng.uniform(0.1, 0.6, n),
+            "time": pd.date_range(t0, periods=n, freq=pd.Timedelta(hours=tstep_h)),
+            "area": rng.uniform(1e3, 1e5, n),
+            "vortex_type": (rng.uniform(size=n) < 0.1).astype(int),
+            "slp": rng.uniform(970, 1020, n),
+        }
+    )
+    return df[columns]
+
+
+def write_vortrack(df, path):
+    """Write a track to a whitespace-delimited vortrack text file."""
+    out = df.copy()
+    out["time"] = out["time"].dt.strftime(TIME_FMT)
+    out.to_csv(path, sep=" ", header=False, index=False, float_format="%.6f")
+
+
+def make_winter_dir(dirname, winter, n_tracks, tstep_h=1, max_len=72, seed=0):
+    """
+    Populate a directory with `n_tracks` synthetic vortrack files within a winter.
+
+    Returns
+    -------
+    list
+        List of created files
+    """
+    dirname = Path(dirname)
+    dirname.mkdir(parents=True, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    w_start, w_end = [pd.Timestamp(i) for i in winter_dates[winter]]
+    n_steps = int((w_end - w_start) / pd.Timedelta(hours=tstep_h)) - max_len
+    fnames = []
+    for i, step in enumerate(np.sort(rng.randint(0, n_steps, n_tracks)), 1):
+        t0 = w_start + pd.Timedelta(hours=int(step) * tstep_h)
+        fname = dirname / VORTRACK_FNAME.format(i)
+        write_vortrack(make_track(rng, t0, tstep_h=tstep_h, max_len=max_len), fname)
+        fnames.append(fname)
+    return fnames
+
+
+def make_run_dir(dirname, winters, n_tracks, tstep_h=1, max_len=72, seed=0):
+    """Create synthetic tracker output for several winters in `dirname` / winter."""
+    dirname = Path(dirname)
+    for i, winter in enumerate(winters):
+        make_winter_dir(
+            dirname / winter, winter, n_tracks, tstep_h=tstep_h, max_len=max_len, seed=seed + i
+        )
+    return dirname
+
+
+def make_lsm(res=0.25, box=bbox, n_blobs=12, seed=0):
+    """
+    Create a synthetic land-sea mask covering `box` on an ERA5-like grid.
+
+    Longitudes are in the (0, 360) range and latitudes are decreasing,
+    so the mask should be loaded with `categorise_and_save.get_lsm(..., shift=True)`.
+
+    Returns
+    -------
+    xarray.DataArray
+    """
+    import xarray as xr
+
+    rng = np.random.RandomState(seed)
+    lons = np.arange(box[0] - 1, box[1] + 1 + res, res)
+    lats = np.arange(box[3] + 1, box[2] - 1 - res, -res)
+    lon2d, lat2d = np.meshgrid(lons, lats)
+    arr = np.zeros(lon2d.shape)
+    for _ in range(n_blobs):
+        clon, clat = rng.uniform(box[0], box[1]), rng.uniform(box[2], box[3])
+        rad = rng.uniform(1, 4)
+        dist2 = ((lon2d - clon) * np.cos(np.deg2rad(lat2d))) ** 2 + (lat2d - clat) ** 2
+        arr = np.maximum(arr, (dist2 < rad ** 2).astype(float))
+    lsm = xr.DataArray(
+        arr[np.newaxis, ...],
+        dims=("time", "latitude", "longitude"),
+        coords={"time": [pd.Timestamp("2000-01-01")], "latitude": lats, "longitude": lons % 360},
+        name="lsm",
+    )
+    return lsm.sortby("longitude")
+
+
+def write_lsm(path, **kwargs):
+    """Save a synthetic land-sea mask to a netCDF file."""
+    lsm = make_lsm(**kwargs)
+    lsm.to_netcdf(path)
+    return path
+
+
+def make_stars_file(path, n_tracks, winters, seed=0, box=bbox):
+    """
+    Write synthetic polar lows to a text file in the format of STARS dataset.
+
+    The file can be read by `obs_tracks_api.read_stars_file`.
+    """
+    rng = np.random.RandomState(seed)
+    header = """% Questions (Q):
+% 1: last time step unclear
+% 2: tracked only one of dual
+% 3: Missing AVHRR
+
+ N   year month day hour min   lat      lon     Q  R(km)
+
+"""
+    lines = []
+    for i in range(1, n_tracks + 1):
+        w_start, w_end = [pd.Timestamp(j) for j in winter_dates[winters[i % len(winters)]]]
+        t0 = w_start + pd.Timedelta(hours=int(rng.randint(0, (w_end - w_start).days * 24 - 48)))
+        df = make_track(rng, t0, tstep_h=1, max_len=36, box=box)
+        diam = rng.randint(100, 500)
+        for row in df.itertuples():
+            lines.append(
+                f"{i:3d}   {row.time:%Y   %m   %d  %H  %M}    {row.lat:5.2f}    {row.lon:5.2f}"
+                f"   0   {diam}\n"
+            )
+    with Path(path).open("w") as fout:
+        fout.write(header)
+        fout.writelines(lines)
+    return path
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""Make modules in the code directory importable in tests."""
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Tests of sampling fields along tracks in along_track.py."""
+import copy
+
+import numpy as np
+
+import pandas as pd
+
+import pytest
+
+import along_track
+from track_io import MUX_NAMES
+
+
+class FakeTrackRun:
+    """Track run holding only a track table."""
+
+    def __init__(self, data):
+        self.data = data
+
+
+def _replace_data(tr, data):
+    out = copy.copy(tr)
+    out.data = data
+    return out
+
+
+def make_frame(n_rows):
+    """Track table of two tracks with `n_rows` rows in total."""
+    track_idx = np.arange(n_rows) // max(1, (n_rows + 1) // 2)
+    row_idx = np.arange(n_rows) - np.searchsorted(track_idx, track_idx)
+    return pd.DataFrame(
+        {
+            "lon": np.linspace(0, 10, n_rows),
+            "lat": np.linspace(70, 75, n_rows),
+            "time": pd.date_range("2019-12-01", periods=n_rows, freq="h"),
+        },
+        index=pd.MultiIndex.from_arrays([track_idx, row_idx], names=MUX_NAMES),
+    )
+
+
+def constant_field(value):
+    """Field reader replaced by its value at every point."""
+    return lambda time: value
+
+
+@pytest.fixture
+def sample_constant(monkeypatch):
+    monkeypatch.setattr(along_track, "replace_data", _replace_data)
+    monkeypatch.setattr(
+        along_track,
+        "interp_points",
+        lambda fld, lon, lat, method="nearest": np.full(lon.shape, float(fld)),
+    )
+
+
+@pytest.mark.parametrize("genesis", [False, True])
+def test_add_columns_empty_table(sample_constant, genesis):
+    tr = FakeTrackRun(make_frame(0))
+    out = along_track.add_columns(tr, {"t2m": dict(field=constant_field(1.0), genesis=genesis)})
+    assert list(out.data.columns) == ["lon", "lat", "time", "t2m"]
+    assert out.data.shape[0] == 0
+
+
+def test_add_columns_genesis_repeated(sample_constant):
+    tr = FakeTrackRun(make_frame(5))
+    out = along_track.add_columns(tr, {"t2m": dict(field=constant_field(2.0), genesis=True)})
+    np.testing.assert_array_equal(out.data["t2m"].values, np.full(5, 2.0))
+    assert "t2m" not in tr.data.columns
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Tests of compact track tables in compact.py."""
+import copy
+
+import numpy as np
+
+import pandas as pd
+
+import pytest
+
+import compact
+from track_io import MUX_NAMES
+
+
+def make_frame(n_tracks=5, n_rows=4, seed=0):
+    """Track table with random fields and an empty category column."""
+    rng = np.random.RandomState(seed)
+    index = pd.MultiIndex.from_product([range(n_tracks), range(n_rows)], names=MUX_NAMES)
+    n = n_tracks * n_rows
+    return pd.DataFrame(
+        {
+            "lon": rng.uniform(-20, 50, n),
+            "lat": rng.uniform(65, 85, n),
+            "vo": rng.uniform(1e-4, 1e-3, n),
+            "vortex_type": rng.randint(0, 3, n),
+            "cat": np.zeros(n, dtype=np.int64),
+        },
+        index=index,
+    )
+
+
+class FakeTrackRun:
+    """Track run setting one category bit per condition, like `TrackRun.classify()`."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def classify(self, conditions, inclusive):
+        cat = self.data["cat"].values.copy()
+        for i, (_, funcs) in enumerate(conditions):
+            ok = np.all([func(self.data) for func in funcs], axis=0)
+            cat[ok] |= cat.dtype.type(1 << i)
+        self.data["cat"] = cat
+
+
+def _replace_data(tr, data):
+    out = copy.copy(tr)
+    out.data = data
+    return out
+
+
+@pytest.mark.parametrize(
+    "n_bits, dtype",
+    [(1, np.uint8), (8, np.uint8), (9, np.uint16), (16, np.uint16), (17, np.uint32)],
+)
+def test_cat_dtype(n_bits, dtype):
+    assert compact.cat_dtype(n_bits) == np.dtype(dtype)
+
+
+@pytest.mark.parametrize("n_bits", [3, 8, 9, 16])
+def test_categories_survive_compaction(n_bits):
+    df = make_frame()
+    df["cat"] = np.arange(df.shape[0]) % (1 << n_bits)
+    small = compact.compact_frame(df, n_cat_bits=n_bits)
+    assert small["cat"].dtype == compact.cat_dtype(n_bits)
+    np.testing.assert_array_equal(small["cat"].values, df["cat"].values)
+    # The highest category bit can still be set
+    highest = small["cat"].values | small["cat"].dtype.type(1 << (n_bits - 1))
+    assert (highest >= 1 << (n_bits - 1)).all()
+
+
+def test_assigned_categories_widen_dtype():
+    df = make_frame()
+    df["cat"] = 1 << 10
+    assert compact.compact_frame(df, n_cat_bits=4)["cat"].dtype == np.uint16
+
+
+def test_columns_round_trip():
+    df = compact.compact_frame(make_frame())
+    columns, offsets, track_ids = compact.to_columns(df, compact=False)
+    assert offsets.dtype == np.int32 and track_ids.dtype == np.int32
+    pd.testing.assert_frame_equal(compact.from_columns(columns, offsets, track_ids), df)
+
+
+@pytest.mark.parametrize("n_conditions", [2, 9])
+def test_check_compact(monkeypatch, n_conditions):
+    monkeypatch.setattr(compact, "replace_data", _replace_data)
+    conditions = [
+        (f"cat{i}", [lambda df, i=i: df["lon"].values > -20 + 5 * i])
+        for i in range(n_conditions)
+    ]
+    result = compact.check_compact(FakeTrackRun(make_frame()), conditions=conditions)
+    assert result["same_categories"]
+    assert result["same_columnar"]
+    assert result["compact_mb"] < result["full_mb"]
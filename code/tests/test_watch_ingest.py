@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Tests of polling tracker output in watch_ingest.py."""
+import numpy as np
+
+import pandas as pd
+
+import pytest
+
+from synthetic import VORTRACK_FNAME, write_vortrack
+from time_index import load_time_index
+from track_io import MUX_NAMES
+import watch_ingest
+
+T0 = pd.Timestamp("2019-12-01")
+TSTEP = np.timedelta64(1, "h")
+LAG = np.timedelta64(2, "h")
+ARCH_KEY = "trackrun"
+
+
+class FakeTracker:
+    """Tracker output written batch by batch, with a clock advanced by the test."""
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.now = T0
+        self.n_files = 0
+
+    def advance(self, hours):
+        self.now += pd.Timedelta(hours=hours)
+
+    def write(self, start_h, n_steps, lon0=0.0, lat0=70.0):
+        """Write a track starting `start_h` hours after `now`."""
+        self.n_files += 1
+        times = pd.date_range(self.now + pd.Timedelta(hours=start_h), periods=n_steps, freq="h")
+        df = pd.DataFrame(
+            {
+                "lon": lon0 + 0.1 * np.arange(n_steps),
+                "lat": np.full(n_steps, lat0),
+                "vo": np.full(n_steps, 0.3),
+                "time": times,
+                "area": np.full(n_steps, 1e4),
+                "vortex_type": np.zeros(n_steps, dtype=int),
+                "slp": np.full(n_steps, 990.0),
+            }
+        )
+        path = self.dirname / VORTRACK_FNAME.format(self.n_files)
+        write_vortrack(df, path)
+        return path
+
+
+class FakeTrackRun:
+    """Track run writing its table to an HDF5 archive in the fixed format, like `TrackRun`."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def to_archive(self, path):
+        with pd.HDFStore(path, mode="w") as store:
+            store.put(ARCH_KEY, self.data.reset_index(), format="fixed")
+            store.get_storer(ARCH_KEY).attrs.metadata = dict(size=len(self.data))
+
+
+def make_tracks(track_ids, n_steps, start):
+    """Track table of straight tracks with `n_steps` points each."""
+    index = pd.MultiIndex.from_product([track_ids, range(n_steps)], names=MUX_NAMES)
+    times = pd.date_range(start, periods=n_steps, freq="h")
+    return pd.DataFrame(
+        {
+            "lon": np.tile(0.1 * np.arange(n_steps), len(track_ids)),
+            "lat": np.full(index.shape[0], 70.0),
+            "time": np.tile(times.values, len(track_ids)),
+            "cat": np.zeros(index.shape[0], dtype=np.int64),
+        },
+        index=index,
+    )
+
+
+@pytest.fixture
+def watcher(tmp_path, monkeypatch):
+    """Tracker output directory, watcher state and a list of archived track tables."""
+    archived = []
+    monkeypatch.setattr(watch_ingest, "trackrun_from_frame", lambda df, dirname: df)
+    monkeypatch.setattr(watch_ingest, "classify_winter", lambda tr, conditions: tr)
+    monkeypatch.setattr(watch_ingest, "append_to_archive", lambda path, tr: archived.append(tr))
+    monkeypatch.setattr(watch_ingest, "update_aggregates", lambda *args: None)
+    out_dir = tmp_path / "tracks"
+    out_dir.mkdir()
+    state_path = tmp_path / "state.json"
+
+    def _poll():
+        state = watch_ingest.load_state(state_path)
+        n_done = watch_ingest.poll(
+            out_dir, state, [], tmp_path / "out.h5", tmp_path / "aggr.npz", TSTEP, LAG, 60.0
+        )
+        watch_ingest.save_state(state_path, state)
+        return n_done, state
+
+    return FakeTracker(out_dir), _poll, archived
+
+
+def test_tracks_are_held_until_lag(watcher):
+    tracker, poll, archived = watcher
+    tracker.write(0, 2)
+    tracker.write(0, 6)
+    n_done, state = poll()
+    assert n_done == 1
+    assert len(state["held"]) == 1
+
+    tracker.advance(10)
+    tracker.write(0, 3)
+    n_done, state = poll()
+    assert n_done == 1
+    assert [len(i) for i in archived] == [2, 6]
+    assert archived[1].index.get_level_values(0)[0] == 1
+
+
+def test_tracks_are_joined_across_batches(watcher):
+    tracker, poll, archived = watcher
+    tracker.write(0, 6)
+    n_done, _ = poll()
+    assert n_done == 0
+
+    tracker.advance(6)
+    # Starts at the next time step, close to where the held track ends
+    tracker.write(0, 4, lon0=0.6)
+    tracker.advance(10)
+    tracker.write(0, 2)
+    n_done, state = poll()
+    assert n_done == 1
+    assert len(archived[0]) == 10
+    assert len(state["held"]) == 1
+
+
+def test_removed_held_files_are_dropped(watcher):
+    tracker, poll, archived = watcher
+    path = tracker.write(0, 6)
+    poll()
+    path.unlink()
+    n_done, state = poll()
+    assert n_done == 0
+    assert state["held"] == []
+    # The saved state can be polled again
+    assert poll()[0] == 0
+    assert archived == []
+
+
+def test_append_to_archive(tmp_path):
+    path = tmp_path / "archive.h5"
+    first = make_tracks([0, 1], 3, T0)
+    second = make_tracks([2], 4, T0 - pd.Timedelta(hours=5))
+    watch_ingest.append_to_archive(path, FakeTrackRun(first), key=ARCH_KEY)
+    watch_ingest.append_to_archive(path, FakeTrackRun(second), key=ARCH_KEY)
+    assert [i.name for i in tmp_path.iterdir()] == ["archive.h5"]
+
+    with pd.HDFStore(path, mode="r") as store:
+        assert store.get_storer(ARCH_KEY).is_table
+        assert store.get_storer(ARCH_KEY).attrs.metadata == dict(size=6)
+        data = store.select(ARCH_KEY).set_index(MUX_NAMES)
+        # Rows of the last track are found by their positions in the table
+        last = store.select(ARCH_KEY, where=np.arange(6, 10)).set_index(MUX_NAMES)
+    pd.testing.assert_frame_equal(data, pd.concat([first, second]))
+    pd.testing.assert_frame_equal(last, second)
+
+    index = load_time_index(path)
+    assert index.index.tolist() == [2, 0, 1]
+    assert index[["pos_start", "pos_end"]].values.tolist() == [[6, 10], [0, 3], [3, 6]]
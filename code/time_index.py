@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Per-track time index for fast selection of tracks within a time window.
+
+The index holds the first and last time and the row positions of each track,
+sorted by genesis time. Tracks that overlap a window [start, end] are then found by
+binary search instead of scanning the whole track table, because such tracks must
+start within [start - longest lifetime, end].
+"""
+import numpy as np
+
+import pandas as pd
+
+from track_io import MUX_NAMES, replace_data
+
+
+INDEX_KEY = "time_index"
+
+
+def build_time_index(data):
+    """
+    Build the time index of a track table.
+
+    Parameters
+    ----------
+    data: pandas.DataFrame
+        Track table with a (track_idx, row_idx) index, where rows of each track
+        are contiguous (e.g. sorted by track_idx)
+
+    Returns
+    -------
+    pandas.DataFrame
+        Table indexed by track_idx with columns t_start, t_end, pos_start, pos_end,
+        sorted by t_start
+    """
+    level = data.index.get_level_values(0).values
+    if level.shape[0] == 0:
+        return pd.DataFrame(
+            {
+                "t_start": np.array([], dtype="datetime64[ns]"),
+                "t_end": np.array([], dtype="datetime64[ns]"),
+                "pos_start": np.array([], dtype=np.int64),
+                "pos_end": np.array([], dtype=np.int64),
+            },
+            index=pd.Index([], name=MUX_NAMES[0]),
+        )
+    pos_start = np.concatenate([[0], np.flatnonzero(np.diff(level)) + 1])
+    pos_end = np.concatenate([pos_start[1:], [level.shape[0]]])
+    times = data["time"].values.astype("datetime64[ns]").view("i8")
+    index = pd.DataFrame(
+        {
+            "t_start": np.minimum.reduceat(times, pos_start).view("datetime64[ns]"),
+            "t_end": np.maximum.reduceat(times, pos_start).view("datetime64[ns]"),
+            "pos_start": pos_start,
+            "pos_end": pos_end,
+        },
+        index=pd.Index(level[pos_start], name=MUX_NAMES[0]),
+    )
+    return index.sort_values("t_start", kind="mergesort")
+
+
+def save_time_index(path, index):
+    """Add the time index to a `TrackRun` archive."""
+    with pd.HDFStore(path, mode="a") as store:
+        store.put(INDEX_KEY, index)
+
+
+def load_time_index(path):
+    """Read the time index from a `TrackRun` archive, if it is there."""
+    with pd.HDFStore(path, mode="r") as store:
+        if f"/{INDEX_KEY}" in store.keys():
+            return store[INDEX_KEY]
+
+
+def _take_ranges(data, pos_start, pos_end):
+    """Select rows in ranges [pos_start, pos_end), avoiding a copy if they are contiguous."""
+    order = np.argsort(pos_start, kind="mergesort")
+    pos_start, pos_end = pos_start[order], pos_end[order]
+    if pos_start.shape[0] == 0:
+        return data.iloc[:0]
+    if (pos_start[1:] == pos_end[:-1]).all():
+        return data.iloc[slice(pos_start[0], pos_end[-1])]
+    counts = pos_end - pos_start
+    pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - pos_start, counts)
+    return data.take(pos)
+
+
+def window_rows(data, start, end, index=None, clip=False):
+    """
+    Select rows of tracks overlapping the time window [start, end].
+
+    Parameters
+    ----------
+    data: pandas.DataFrame
+        Track table
+    start, end: str or datetime-like
+        Bounds of the time window (inclusive)
+    index: pandas.DataFrame, optional
+        Time index of `data`, built if not given
+    clip: bool, optional
+        If True, drop points outside the time window, as `TrackRun.time_slice()` does.
+        Otherwise, select whole tracks.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    if index is None:
+        index = build_time_index(data)
+    start, end = np.datetime64(pd.Timestamp(start), "ns"), np.datetime64(pd.Timestamp(end), "ns")
+    t_start = index["t_start"].values
+    max_duration = (index["t_end"].values - t_start).max() if t_start.shape[0] else 0
+    i0 = np.searchsorted(t_start, start - max_duration, side="left")
+    i1 = np.searchsorted(t_start, end, side="right")
+    cand = index.iloc[i0:i1]
+    cand = cand[cand["t_end"].values >= start]
+    rows = _take_ranges(data, cand["pos_start"].values, cand["pos_end"].values)
+    if clip:
+        time = rows["time"].values
+        rows = rows[(time >= start) & (time <= end)]
+    return rows
+
+
+def time_window(tr, start, end, index=None, clip=False):
+    """
+    Select tracks of a `TrackRun` overlapping the time window [start, end].
+
+    See `window_rows()` for details.
+
+    Returns
+    -------
+    octant.core.TrackRun
+    """
+    return replace_data(tr, window_rows(tr.data, start, end, index=index, clip=clip))
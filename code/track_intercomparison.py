@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Match tracks of several datasets and runs with each other in both directions.
+
+For each pair of runs and each subset, the mean separation distance of two tracks
+over their common time steps is used as in the "bs2000" matching method; two tracks
+are matched if it is below `beta` km. Such tracks must come within `beta` km of each
+other at least once, so candidate pairs are first found by joining track points
+on time and on cells of a `beta`-sized grid (with neighbouring cells), and
+the mean distance is then computed only for these pairs. The same table of candidate
+pairs gives the best match of every track of the first run in the second one and
+vice versa. Pairs of runs are processed in parallel worker processes.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations, product
+from pathlib import Path
+import sys
+from textwrap import dedent
+
+from loguru import logger as L
+
+import numpy as np
+
+import pandas as pd
+
+from along_track import great_circle_km
+from archive_cache import archive_path, load_trackrun
+from common_defs import CAT, EARTH_RADIUS, period
+import mypaths
+from track_io import MUX_NAMES
+
+SCRIPT = Path(__file__).name
+COLUMNS = ["lon", "lat", "time", "cat"]
+
+
+def parse_args(args=None):
+    """Parse command line arguments."""
+    epilog = dedent(
+        f"""Example of use:
+    ./{SCRIPT} --runs era5:0,interim:100,interim:106 --subsets pmc -j 3
+    """
+    )
+    ap = argparse.ArgumentParser(
+        SCRIPT,
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog=epilog,
+    )
+    ap.add_argument(
+        "--runs",
+        type=str,
+        required=True,
+        help="Comma-separated list of dataset:run_id pairs",
+    )
+    ap.add_argument("--subsets", type=str, default=CAT, help="Comma-separated list of subsets")
+    ap.add_argument("--beta", type=float, default=50.0, help="Maximum mean distance [km]")
+    ap.add_argument("-j", "--nproc", type=int, default=1, help="Number of worker processes")
+    ap.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=str(mypaths.procdir / f"intercomparison_{period}.h5"),
+        help="Output file",
+    )
+    return ap.parse_args(args)
+
+
+CELL_COLUMNS = ["cx", "cy", "cz"]
+
+
+def _points(data, cell_km=None):
+    """
+    Track points as a flat table with a track_idx column.
+
+    If `cell_km` is given, indices of the point in a Cartesian grid of cubes with
+    edges of `cell_km` km are added. Points within `cell_km` km of each other are
+    in the same or adjacent cells, regardless of latitude.
+    """
+    points = pd.DataFrame(
+        {
+            "track_idx": data.index.get_level_values(MUX_NAMES[0]).values,
+            "time": data["time"].values,
+            "lon": data["lon"].values,
+            "lat": data["lat"].values,
+        }
+    )
+    if cell_km is not None:
+        lon, lat = np.deg2rad(points["lon"].values), np.deg2rad(points["lat"].values)
+        xyz = [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+        for col, arr in zip(CELL_COLUMNS, xyz):
+            points[col] = np.floor(arr * EARTH_RADIUS / cell_km).astype(np.int64)
+    return points
+
+
+def _add_distance(joined):
+    lon_a, lat_a, lon_b, lat_b = [joined[i].values for i in ["lon_a", "lat_a", "lon_b", "lat_b"]]
+    joined["dist_km"] = great_circle_km(lon_a, lat_a, lon_b, lat_b)
+    return joined
+
+
+def close_pairs(data_a, data_b, beta=50.0):
+    """
+    Pairs of tracks that are within `beta` km of each other at least at one time step.
+
+    Points are joined on time and grid cell, so only points in the same or
+    adjacent cells are compared instead of all points at the same time.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Table with columns track_idx_a, track_idx_b
+    """
+    points_a, points_b = _points(data_a, cell_km=beta), _points(data_b, cell_km=beta)
+    # Copies of the points of the second run shifted to all 27 neighbouring cells
+    shifts = np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1])).reshape(3, -1).T
+    shifted = points_b.loc[np.repeat(points_b.index.values, shifts.shape[0])]
+    shifted[CELL_COLUMNS] += np.tile(shifts, (points_b.shape[0], 1))
+    joined = pd.merge(points_a, shifted, on=["time"] + CELL_COLUMNS, suffixes=("_a", "_b"))
+    joined = _add_distance(joined)
+    close = joined.loc[joined["dist_km"] <= beta, ["track_idx_a", "track_idx_b"]]
+    return close.drop_duplicates().reset_index(drop=True)
+
+
+def candidate_pairs(data_a, data_b, beta=50.0):
+    """
+    Mean distance between tracks of two track tables over their common time steps.
+
+    Only pairs of tracks that come within `beta` km of each other are considered,
+    because the mean distance of other pairs is larger than `beta`.
+
+    Parameters
+    ----------
+    data_a, data_b: pandas.DataFrame
+        Track tables with a (track_idx, row_idx) index
+    beta: float, optional
+        Maximum mean distance [km] between matching tracks
+
+    Returns
+    -------
+    pandas.DataFrame
+        Table with columns track_idx_a, track_idx_b, mean_dist_km, n_common,
+        one row for each pair of tracks that are within `beta` km at least once
+    """
+    pairs = close_pairs(data_a, data_b, beta=beta)
+    points_a = _points(data_a).rename(columns=lambda i: f"{i}_a" if i != "time" else i)
+    points_b = _points(data_b).rename(columns=lambda i: f"{i}_b" if i != "time" else i)
+    joined = pd.merge(pairs, points_a, on="track_idx_a")
+    joined = pd.merge(joined, points_b, on=["track_idx_b", "time"])
+    joined = _add_distance(joined)
+    pairs = joined.groupby(["track_idx_a", "track_idx_b"])["dist_km"].agg(["mean", "size"])
+    return pairs.rename(columns={"mean": "mean_dist_km", "size": "n_common"}).reset_index()
+
+
+def best_matches(pairs, track_ids, this="a", other="b", beta=50.0):
+    """
+    Best match of each track among the candidate pairs.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Table indexed by track_idx of `this` run with the matching track_idx of the
+        `other` run (-1 if not matched), the mean distance and the number of common time steps
+    """
+    ok = pairs[pairs["mean_dist_km"] <= beta].sort_values("mean_dist_km", kind="mergesort")
+    best = ok.drop_duplicates(f"track_idx_{this}").set_index(f"track_idx_{this}")
+    table = pd.DataFrame(index=pd.Index(track_ids, name="track_idx"))
+    table["other_track_idx"] = best[f"track_idx_{other}"].reindex(track_ids).fillna(-1).astype(int)
+    table["mean_dist_km"] = best["mean_dist_km"].reindex(track_ids).values
+    table["n_common"] = best["n_common"].reindex(track_ids).fillna(0).astype(int).values
+    return table
+
+
+def compare_pair(task):
+    """
+    Match tracks of two runs in both directions.
+
+    Parameters
+    ----------
+    task: tuple
+        (label_a, path_a, label_b, path_b, subset, beta)
+
+    Returns
+    -------
+    tracks: pandas.DataFrame
+        Per-track match table for both directions
+    summary: list
+        List of two dictionaries with overlap statistics, one for each direction
+    """
+    label_a, path_a, label_b, path_b, subset, beta = task
+    labels = dict(a=label_a, b=label_b)
+    data = {
+        "a": load_trackrun(path_a, subset=subset, columns=COLUMNS).data,
+        "b": load_trackrun(path_b, subset=subset, columns=COLUMNS).data,
+    }
+    track_ids = {
+        key: np.unique(val.index.get_level_values(MUX_NAMES[0]).values)
+        for key, val in data.items()
+    }
+    pairs = candidate_pairs(data["a"], data["b"], beta=beta)
+    tracks, summary = [], []
+    for this, other in [("a", "b"), ("b", "a")]:
+        table = best_matches(pairs, track_ids[this], this=this, other=other, beta=beta)
+        table = table.reset_index().assign(run=labels[this], other=labels[other], subset=subset)
+        tracks.append(table)
+        n_tracks, n_other = track_ids[this].shape[0], track_ids[other].shape[0]
+        n_matched = int((table["other_track_idx"] >= 0).sum())
+        summary.append(
+            dict(
+                run=labels[this],
+                other=labels[other],
+                subset=subset,
+                n_tracks=n_tracks,
+                n_other=n_other,
+                n_matched=n_matched,
+                coincidence=n_matched / n_tracks if n_tracks else np.nan,
+                missing_ratio=(n_tracks - n_matched) / n_other if n_other else np.nan,
+            )
+        )
+    L.info(f"{label_a} vs {label_b} ({subset}): {len(pairs)} candidate pairs")
+    return pd.concat(tracks, ignore_index=True), summary
+
+
+def intercompare(runs, subsets=(CAT,), beta=50.0, nproc=1):
+    """
+    Match tracks of every pair of runs in both directions for each subset.
+
+    Parameters
+    ----------
+    runs: dict
+        Labels and paths to `TrackRun` archives
+    subsets: sequence, optional
+        Subsets of tracks, e.g. "pmc"; None for all tracks
+    beta: float, optional
+        Maximum mean distance [km] between matching tracks
+    nproc: int, optional
+        Number of worker processes
+
+    Returns
+    -------
+    tracks: pandas.DataFrame
+        Per-track match table
+    summary: pandas.DataFrame
+        Overlap statistics for each ordered pair of runs and subset
+    """
+    tasks = [
+        (label_a, runs[label_a], label_b, runs[label_b], subset, beta)
+        for (label_a, label_b), subset in product(combinations(runs, 2), subsets)
+    ]
+    if nproc > 1:
+        with ProcessPoolExecutor(max_workers=nproc) as executor:
+            results = list(executor.map(compare_pair, tasks))
+    else:
+        results = [compare_pair(task) for task in tasks]
+    tracks = pd.concat([res[0] for res in results], ignore_index=True)
+    summary = pd.DataFrame([rec for res in results for rec in res[1]])
+    return tracks, summary
+
+
+def main(args=None):
+    """Match tracks of the selected runs and save the per-track table and statistics."""
+    args = parse_args(args)
+    runs = {}
+    for item in args.runs.split(","):
+        dset, run_id = item.split(":")
+        runs[f"{dset}_run{int(run_id):03d}"] = archive_path(dset, int(run_id))
+    tracks, summary = intercompare(
+        runs, subsets=args.subsets.split(","), beta=args.beta, nproc=args.nproc
+    )
+    with pd.HDFStore(args.output, mode="w") as store:
+        store.put("tracks", tracks, format="table", data_columns=["run", "other", "subset"])
+        store.put("summary", summary)
+    L.info(f"Saved to {args.output}")
+    L.info(f"Summary:\n{summary.to_string(index=False)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
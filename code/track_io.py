@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk reading of vortrack text files with a columnar binary cache.
+
+All files of a directory are parsed in one go into a single table, with
+track boundaries stored as an array of offsets. The table is saved as
+a set of `.npy` files next to the tracker output, so that subsequent loads
+can memory-map it instead of parsing text files again.
+"""
+from contextlib import contextmanager
+import copy
+import io
+import json
+import os
+from pathlib import Path
+import tempfile
+
+from loguru import logger
+
+import numpy as np
+
+import pandas as pd
+
+from common_defs import columns as COLUMNS
+
+
+WCARD = "vortrack*0001.txt"
+TIME_FMT = "%Y%m%d%H%M"
+# Scale factor converting vorticity in vortrack files to SI units
+SCALE_VO = 1e-3
+CACHE_DIR = "_columnar"
+MUX_NAMES = ["track_idx", "row_idx"]
+
+
+def scan_dir(dirname, wcard=WCARD):
+    """
+    List non-empty track files in a directory with their size and modification time.
+
+    Returns
+    -------
+    list
+        Sorted list of (file name, size, modification time) tuples
+    """
+    entries = []
+    for fname in sorted(Path(dirname).glob(wcard)):
+        st = fname.stat()
+        if st.st_size > 0:
+            entries.append((fname.name, st.st_size, st.st_mtime_ns))
+    return entries
+
+
+def read_vortrack_files(fnames, columns=COLUMNS, scale_vo=SCALE_VO):
+    """
+    Parse many vortrack files into one columnar table.
+
+    The contents of all files are concatenated in memory and parsed with a single
+    call to the C parser of `pandas.read_csv`.
+
+    Parameters
+    ----------
+    fnames: list of path-like
+        List of vortrack files, each containing one track
+    columns: list, optional
+        Column names
+    scale_vo: float, optional
+        Scale factor for the vorticity column
+
+    Returns
+    -------
+    data: dict
+        Dictionary of numpy arrays, one for each column
+    offsets: numpy.ndarray
+        Row offsets of tracks in the table, of size (number of tracks + 1)
+    """
+    chunks = []
+    counts = []
+    for fname in fnames:
+        with open(fname, "rb") as fin:
+            # Blank lines are skipped by the parser, so they must not be counted as rows
+            lines = [line for line in fin.read().splitlines() if line.strip()]
+        chunks.append(b"\n".join(lines) + b"\n" if lines else b"")
+        counts.append(len(lines))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    if offsets[-1] == 0:
+        data = {col: np.array([]) for col in columns}
+        data["time"] = np.array([], dtype="datetime64[ns]")
+        return data, offsets
+
+    df = pd.read_csv(
+        io.BytesIO(b"".join(chunks)),
+        sep=r"\s+",
+        names=columns,
+        header=None,
+        dtype={"time": str},
+    )
+    if df.shape[0] != offsets[-1]:
+        raise ValueError(f"Parsed {df.shape[0]} rows, expected {offsets[-1]}")
+    data = {col: df[col].values for col in columns}
+    data["time"] = pd.to_datetime(df["time"], format=TIME_FMT).values
+    if "vo" in data:
+        data["vo"] = data["vo"] * scale_vo
+    return data, offsets
+
+
+def offsets_to_index(offsets, track_ids=None):
+    """
+    Convert track offsets to a (track_idx, row_idx) `pandas.MultiIndex`.
+
+    Tracks are numbered from 0 unless `track_ids` are given.
+    """
+    counts = np.diff(offsets)
+    if track_ids is None:
+        track_ids = np.arange(counts.shape[0])
+    # Same int64 levels as the index of tables read from archives
+    track_idx = np.repeat(np.asarray(track_ids, dtype=np.int64), counts)
+    row_idx = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], counts)
+    return pd.MultiIndex.from_arrays([track_idx, row_idx], names=MUX_NAMES)
+
+
+def index_to_offsets(index):
+    """
+    Convert a (track_idx, row_idx) `pandas.MultiIndex` to track offsets.
+
+    Rows of each track should be contiguous.
+
+    Returns
+    -------
+    offsets: numpy.ndarray
+        Row offsets of tracks, of size (number of tracks + 1)
+    track_ids: numpy.ndarray
+        Track indices
+    """
+    level = index.get_level_values(0).values
+    starts = np.flatnonzero(np.diff(level)) + 1
+    if level.shape[0] == 0:
+        return np.zeros(1, dtype=np.int64), level
+    offsets = np.concatenate([[0], starts, [level.shape[0]]])
+    return offsets, level[offsets[:-1]]
+
+
+def to_frame(data, offsets, track_ids=None):
+    """Make a track table with a (track_idx, row_idx) index from columnar data."""
+    df = pd.DataFrame(data, index=offsets_to_index(offsets, track_ids=track_ids))
+    if "cat" not in df.columns:
+        df["cat"] = 0
+    return df
+
+
+def trackrun_from_frame(df, dirname=None):
+    """
+    Create a `TrackRun` from a `pandas.DataFrame` with a (track_idx, row_idx) index.
+
+    If `dirname` contains a tracking configuration file, it is loaded too.
+    """
+    from octant.core import OctantTrack, TrackRun, TrackSettings
+
+    tr = TrackRun()
+    tr.data = OctantTrack.from_mux_df(df)
+    if dirname is not None:
+        tr.sources.append(str(dirname))
+        conf_files = sorted(Path(dirname).glob("*.conf"))
+        if conf_files:
+            tr.conf = TrackSettings(conf_files[0])
+    return tr
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Yield a temporary path in the directory of `path` and move it to `path` on success.
+
+    Readers, including those that have memory-mapped the old file, never see
+    a partially written file.
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        yield Path(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def save_npy(path, arr):
+    """Save an array to a `.npy` file atomically."""
+    with atomic_path(path) as tmp, tmp.open("wb") as fout:
+        np.save(fout, arr)
+
+
+def write_cache(dirname, data, offsets, entries):
+    """
+    Save columnar track data as uncompressed `.npy` files in `dirname`/`CACHE_DIR`.
+
+    The index file is removed first and written last, so that the cache is not
+    read until all arrays are complete.
+    """
+    cache_dir = Path(dirname) / CACHE_DIR
+    cache_dir.mkdir(exist_ok=True)
+    (cache_dir / "index.json").unlink(missing_ok=True)
+    for col, arr in data.items():
+        save_npy(cache_dir / f"{col}.npy", arr)
+    save_npy(cache_dir / "offsets.npy", offsets)
+    with atomic_path(cache_dir / "index.json") as tmp, tmp.open("w") as fout:
+        json.dump(dict(columns=list(data.keys()), files=entries), fout)
+
+
+def read_cache(dirname, entries=None, mmap_mode="r"):
+    """
+    Memory-map columnar track data from the cache in `dirname`.
+
+    Returns None if the cache does not exist or `entries` does not match the files
+    it was created from.
+    """
+    cache_dir = Path(dirname) / CACHE_DIR
+    try:
+        with (cache_dir / "index.json").open("r") as fin:
+            meta = json.load(fin)
+    except FileNotFoundError:
+        return None
+    if entries is not None and [list(i) for i in entries] != meta["files"]:
+        logger.debug(f"Cache in {dirname} is out of date")
+        return None
+    offsets = np.load(cache_dir / "offsets.npy")
+    data = {col: np.load(cache_dir / f"{col}.npy", mmap_mode=mmap_mode) for col in meta["columns"]}
+    return data, offsets
+
+
+def ingest_dir(dirname, columns=COLUMNS, wcard=WCARD, use_cache=True, update_cache=True):
+    """
+    Load all tracks from a directory into columnar arrays.
+
+    Parameters
+    ----------
+    dirname: path-like
+        Directory with tracker output
+    columns: list, optional
+        Column names
+    wcard: str, optional
+        Wildcard of track files
+    use_cache: bool, optional
+        Read the cache if it is up to date
+    update_cache: bool, optional
+        Write the cache after parsing text files
+
+    Returns
+    -------
+    data: dict
+        Dictionary of numpy arrays, one for each column
+    offsets: numpy.ndarray
+        Row offsets of tracks in the table
+    """
+    dirname = Path(dirname)
+    entries = scan_dir(dirname, wcard=wcard)
+    if use_cache:
+        cached = read_cache(dirname, entries=entries)
+        if cached is not None:
+            return cached
+    data, offsets = read_vortrack_files([dirname / i[0] for i in entries], columns=columns)
+    if update_cache:
+        write_cache(dirname, data, offsets, entries)
+    return data, offsets
+
+
+def load_tracks(dirname, columns=COLUMNS, use_cache=True, update_cache=True):
+    """Load all tracks from a directory into a `TrackRun`, using the columnar cache."""
+    data, offsets = ingest_dir(
+        dirname, columns=columns, use_cache=use_cache, update_cache=update_cache
+    )
+    return trackrun_from_frame(to_frame(data, offsets), dirname=dirname)
+
+
+def replace_data(tr, data):
+    """Make a shallow copy of a `TrackRun` with its track table replaced by `data`."""
+    from octant.core import OctantTrack
+
+    out = copy.copy(tr)
+    out.data = OctantTrack.from_mux_df(data)
+    return out
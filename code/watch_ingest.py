@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Watch a tracker output directory and categorise new tracks as they are finished.
+
+Each poll reads only new or modified track files and tracks still held from the
+previous poll. A track is finished once the tracker output has moved at least
+`--lag` hours past its last point; otherwise it is held until the next poll.
+If the tracker is restarted for every new batch of data, a track crossing the
+batch boundary is split into two files: a new track starting where a held track
+ends (same or next time step, within `--link-km`) is joined to it.
+Finished tracks are classified, appended in place to the track table of the
+archive of the current season, and added to the density and monthly count aggregates.
+"""
+import argparse
+from datetime import datetime
+import json
+from pathlib import Path
+import sys
+from textwrap import dedent
+import time
+
+from loguru import logger as L
+
+import numpy as np
+
+import pandas as pd
+
+from along_track import great_circle_km
+from categorise_and_save import classify_winter, lsm_paths, make_conditions, make_masks
+from common_defs import CAT, bbox, columns, dset_ctrl_tstep_h
+import mypaths
+from time_index import build_time_index, load_time_index, save_time_index
+from track_io import atomic_path, read_vortrack_files, replace_data, scan_dir, to_frame
+from track_io import trackrun_from_frame
+
+SCRIPT = Path(__file__).name
+# Grid of density aggregates
+DENS_STEP = 0.5
+
+
+def parse_args(args=None):
+    """Parse command line arguments."""
+    epilog = dedent(
+        f"""Example of use:
+    ./{SCRIPT} -n era5 -r 0 --interval 60
+    ./{SCRIPT} -n era5 -r 0 --dir /path/to/tracker/output --season 2019_2020 --once
+
+    A local stand-in for the tracker output can be made using `synthetic.make_winter_dir()`.
+    """
+    )
+    ap = argparse.ArgumentParser(
+        SCRIPT,
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog=epilog,
+    )
+    ap.add_argument(
+        "-n",
+        "--name",
+        type=str,
+        required=True,
+        choices=["era5", "interim"],
+        help="Name of the dataset",
+    )
+    ap.add_argument("-r", "--run", type=int, default=0, help="Run number")
+    ap.add_argument(
+        "--season",
+        type=str,
+        default=None,
+        help="Season, e.g. 2019_2020; the current one if not given",
+    )
+    ap.add_argument(
+        "--dir",
+        type=str,
+        default=None,
+        help="Directory with tracker output; trackresdir/name/runXXX/season if not given",
+    )
+    ap.add_argument(
+        "--betterlandmask",
+        action="store_true",
+        help=("Use smoothed ERA5 land mask for both reanalyses"),
+    )
+
+    ag_watch = ap.add_argument_group(title="Watching")
+    ag_watch.add_argument("--interval", type=float, default=60.0, help="Polling interval [s]")
+    ag_watch.add_argument("--once", action="store_true", help="Process new files once and exit")
+    ag_watch.add_argument(
+        "--lag",
+        type=float,
+        default=None,
+        help="Hours after which a track is finished; 2 time steps of the dataset if not given",
+    )
+    ag_watch.add_argument(
+        "--link-km",
+        type=float,
+        default=60.0,
+        help="Maximum distance [km] for joining tracks across batches",
+    )
+    return ap.parse_args(args)
+
+
+def current_season(now=None):
+    """Name of the winter season (Oct-Apr) containing `now`."""
+    now = now or datetime.utcnow()
+    year = now.year if now.month >= 7 else now.year - 1
+    return f"{year}_{year + 1}"
+
+
+def load_state(path):
+    """Load the state of the watcher from a JSON file."""
+    try:
+        with path.open("r") as fin:
+            return json.load(fin)
+    except FileNotFoundError:
+        return dict(seen={}, held=[], horizon=None, next_track_idx=0)
+
+
+def save_state(path, state):
+    """Save the state of the watcher, replacing the file atomically."""
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("w") as fout:
+        json.dump(state, fout, indent=1)
+    tmp.replace(path)
+
+
+def read_files(dirname, fnames):
+    """Read track files in one go into a dictionary of file names and tracks."""
+    data, offsets = read_vortrack_files([Path(dirname) / i for i in fnames], columns=columns)
+    split = {col: np.split(arr, offsets[1:-1]) for col, arr in data.items()}
+    return {fname: {col: arr[i] for col, arr in split.items()} for i, fname in enumerate(fnames)}
+
+
+def join_parts(parts):
+    """Join parts of a track, sorted by time and without points duplicated at the boundary."""
+    track = {col: np.concatenate([part[col] for part in parts]) for col in parts[0]}
+    _, first = np.unique(track["time"], return_index=True)
+    return {col: arr[first] for col, arr in track.items()}
+
+
+def stitch(held, new, tstep, link_km):
+    """
+    Join new tracks to held tracks ending where the new ones start.
+
+    Parameters
+    ----------
+    held, new: list
+        Lists of (file names, track) pairs, where track is a dictionary of arrays
+    tstep: numpy.timedelta64
+        Time step of the tracker output
+    link_km: float
+        Maximum distance between the end of a held track and the start of a new one
+
+    Returns
+    -------
+    list
+        List of file name groups
+    """
+    groups = [list(files) for files, _ in held]
+    if not held or not new:
+        return groups + [list(files) for files, _ in new]
+    end_t = np.array([trk["time"][-1] for _, trk in held])
+    end_lon = np.array([trk["lon"][-1] for _, trk in held])
+    end_lat = np.array([trk["lat"][-1] for _, trk in held])
+    start_t = np.array([trk["time"][0] for _, trk in new])
+    start_lon = np.array([trk["lon"][0] for _, trk in new])
+    start_lat = np.array([trk["lat"][0] for _, trk in new])
+    # Matrix of (held, new) pairs
+    dt = start_t[np.newaxis, :] - end_t[:, np.newaxis]
+    dist = great_circle_km(end_lon[:, np.newaxis], end_lat[:, np.newaxis], start_lon, start_lat)
+    ok = (dt >= np.timedelta64(0)) & (dt <= tstep) & (dist <= link_km)
+    dist = np.where(ok, dist, np.inf)
+    for j, (files, _) in enumerate(new):
+        i = np.argmin(dist[:, j])
+        if np.isfinite(dist[i, j]):
+            L.debug(f"Joining {files} to {groups[i]}")
+            groups[i].extend(files)
+            dist[i, :] = np.inf
+        else:
+            groups.append(list(files))
+    return groups
+
+
+def append_to_archive(path, tr, key=None):
+    """
+    Append tracks to a `TrackRun` archive in place, creating it if necessary, and update the index.
+
+    The track table is stored in the appendable HDF5 table format, so that tracks
+    already archived are not read again. A new archive is written to a temporary
+    file and moved into place once complete.
+
+    Parameters
+    ----------
+    path: pathlib.Path
+        Path to the archive
+    tr: octant.core.TrackRun
+        Track run with new tracks
+    key: str, optional
+        Key of the track table in the archive; that of `TrackRun.to_archive()` by default
+    """
+    if key is None:
+        from octant.params import ARCH_KEY as key
+
+    if not path.exists():
+        with atomic_path(path) as tmp:
+            # The archive is created by to_archive()
+            tmp.unlink()
+            tr.to_archive(tmp)
+            with pd.HDFStore(tmp, mode="a") as store:
+                data, meta = store[key], store.get_storer(key).attrs.metadata
+                store.put(key, data, format="table")
+                store.get_storer(key).attrs.metadata = meta
+            save_time_index(tmp, build_time_index(tr.data))
+        return
+    with pd.HDFStore(path, mode="a") as store:
+        n_rows = store.get_storer(key).nrows
+        # Same layout as the table written by to_archive(), with the index as columns
+        store.append(key, pd.DataFrame(tr.data).reset_index(), format="table")
+    # Row positions of the new tracks follow those already in the archive
+    index = build_time_index(tr.data)
+    index[["pos_start", "pos_end"]] += n_rows
+    index = pd.concat([load_time_index(path), index]).sort_values("t_start", kind="mergesort")
+    save_time_index(path, index)
+
+
+def update_aggregates(path, tr, lon1d, lat1d):
+    """Add density maps and monthly genesis counts of `CAT` tracks to aggregates in `path`."""
+    from octant.misc import calc_all_dens
+
+    data = tr[CAT]
+    if path.exists():
+        with np.load(path) as npz:
+            aggr = dict(npz)
+    else:
+        aggr = dict(lon=lon1d, lat=lat1d, monthly=np.zeros(12, dtype=np.int64))
+    if data.shape[0] > 0:
+        months = pd.DatetimeIndex(data.xs(0, level="row_idx")["time"].values).month.values
+        aggr["monthly"] = aggr["monthly"] + np.bincount(months - 1, minlength=12)
+        dens = calc_all_dens(replace_data(tr, data), lon1d, lat1d, method="cell")
+        for key in dens.data_vars:
+            aggr[key] = aggr.get(key, 0) + dens[key].values
+    np.savez(path, **aggr)
+
+
+def poll(dirname, state, conditions, out_path, aggr_path, tstep, lag, link_km):
+    """
+    Process new track files once.
+
+    Returns
+    -------
+    int
+        Number of tracks categorised and archived
+    """
+    entries = {name: [size, mtime] for name, size, mtime in scan_dir(dirname)}
+    held_files = {fname for group in state["held"] for fname in group}
+    new_files = []
+    for fname, sig in entries.items():
+        if fname in held_files:
+            continue
+        if fname not in state["seen"]:
+            new_files.append(fname)
+        elif state["seen"][fname] != sig:
+            L.warning(f"{fname} was modified after it had been archived; ignored")
+    if not new_files and all(state["seen"].get(i) == entries.get(i) for i in held_files):
+        return 0
+
+    held_groups = [group for group in state["held"] if all(i in entries for i in group)]
+    if len(held_groups) < len(state["held"]):
+        n_dropped = len(state["held"]) - len(held_groups)
+        L.warning(f"{n_dropped} held tracks have missing files and are dropped")
+    if not held_groups and not new_files:
+        state["held"] = []
+        return 0
+    parts = read_files(dirname, [fname for group in held_groups for fname in group] + new_files)
+    groups = stitch(
+        [(group, join_parts([parts[i] for i in group])) for group in held_groups],
+        [([fname], parts[fname]) for fname in new_files],
+        tstep,
+        link_km,
+    )
+    tracks = [join_parts([parts[i] for i in group]) for group in groups]
+
+    last_times = np.array([trk["time"][-1] for trk in tracks], dtype="datetime64[ns]")
+    horizon = last_times.max() if last_times.shape[0] else None
+    if state["horizon"] is not None:
+        horizon = max(horizon, np.datetime64(state["horizon"], "ns"))
+    finished = last_times <= horizon - lag
+
+    for fname in new_files + list(held_files):
+        if fname in entries:
+            state["seen"][fname] = entries[fname]
+    state["held"] = [group for group, done in zip(groups, finished) if not done]
+    state["horizon"] = str(horizon)
+
+    n_done = int(finished.sum())
+    if n_done > 0:
+        done = [trk for trk, ok in zip(tracks, finished) if ok]
+        offsets = np.concatenate([[0], np.cumsum([trk["time"].shape[0] for trk in done])])
+        data = {col: np.concatenate([trk[col] for trk in done]) for col in done[0]}
+        track_ids = np.arange(n_done) + state["next_track_idx"]
+        tr = trackrun_from_frame(to_frame(data, offsets, track_ids=track_ids), dirname=dirname)
+        classify_winter(tr, conditions)
+        append_to_archive(out_path, tr)
+        update_aggregates(
+            aggr_path,
+            tr,
+            np.arange(bbox[0] + 1, bbox[1] - 1 + 0.1, DENS_STEP),
+            np.arange(bbox[2] + 1, bbox[3] - 1 + 0.1, DENS_STEP),
+        )
+        state["next_track_idx"] += n_done
+    L.info(f"Horizon {horizon}: {n_done} tracks archived, {len(state['held'])} held")
+    return n_done
+
+
+def main(args=None):
+    """Poll the tracker output directory and process new tracks."""
+    args = parse_args(args)
+    season = args.season or current_season()
+    dirname = (
+        Path(args.dir)
+        if args.dir
+        else mypaths.trackresdir / args.name / f"run{args.run:03d}" / season
+    )
+    label = f"{args.name}_run{args.run:03d}_{season}"
+    out_path = mypaths.procdir / f"{label}.h5"
+    aggr_path = mypaths.procdir / f"aggr_{label}.npz"
+    state_path = mypaths.procdir / f"watch_{label}.json"
+    tstep = np.timedelta64(dset_ctrl_tstep_h[args.name], "h")
+    lag = tstep * 2 if args.lag is None else np.timedelta64(int(args.lag * 3600), "s")
+
+    mask, gen_mask = make_masks(
+        lsm_paths["era5" if args.betterlandmask else args.name], bbox, smooth=args.betterlandmask
+    )
+    conditions = make_conditions(mask, gen_mask)
+
+    state = load_state(state_path)
+    L.info(f"Watching {dirname}")
+    while True:
+        t0 = time.monotonic()
+        if dirname.exists():
+            poll(dirname, state, conditions, out_path, aggr_path, tstep, lag, args.link_km)
+            save_state(state_path, state)
+        if args.once:
+            break
+        time.sleep(max(args.interval - (time.monotonic() - t0), 0))
+
+
+if __name__ == "__main__":
+    sys.exit(main())